@@ -6,26 +6,114 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import base64
+import datetime
+import email.utils
+import http.client
+import io
 import json
 import os
 import pathlib
 import re
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import traceback
-from typing import Any, Optional, Tuple
+from typing import (Any, Callable, Dict, Iterator, List, NamedTuple, NoReturn, Optional,
+    Sequence, Set, Tuple)
+import urllib.error
 import urllib.parse
 import urllib.request
+import zlib
 
 
 
 repoDirPath = pathlib.Path(__file__).parent.parent
+cacheDirPath = pathlib.Path(os.environ.get("LTEX_TOOLS_CACHE_DIR",
+    str(repoDirPath.joinpath("tools", ".cache"))))
+metadataCacheFilePath = cacheDirPath.joinpath("metadata.json")
+gitHubRemoteUrlRegex = re.compile(r"github\.com[:/](.*?)/(.*?)(?:\.git)?$")
+
+# resolved lazily on first access via __getattr__
+toBeDownloadedLtexLsTag: str
+toBeDownloadedLtexLsVersion: str
+toBeDownloadedLtexLsHashDigests: Dict[str, str]
+organization: str
+repository: str
+
+
+
+def __getattr__(name: str) -> Any:
+  if name in ["toBeDownloadedLtexLsTag", "toBeDownloadedLtexLsVersion"]:
+    values: Tuple[str, str] = getToBeDownloadedVersions()
+    globals().update(zip(["toBeDownloadedLtexLsTag", "toBeDownloadedLtexLsVersion"], values))
+  elif name == "toBeDownloadedLtexLsHashDigests":
+    globals()[name] = getToBeDownloadedHashDigests()
+  elif name in ["organization", "repository"]:
+    values = getGitHubOrganizationRepository()
+    globals().update(zip(["organization", "repository"], values))
+  else:
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+  return globals()[name]
+
+
+
+def getCachedMetadata(name: str, filePaths: Sequence[pathlib.Path],
+      compute: Callable[[], Any]) -> Any:
+  key = []
+
+  for filePath in filePaths:
+    fileStat = filePath.stat()
+    key.append([str(filePath.resolve()), fileStat.st_mtime_ns, fileStat.st_size])
+
+  try:
+    with open(metadataCacheFilePath, "r") as f: metadataCache = json.load(f)
+  except (OSError, ValueError):
+    metadataCache = {}
+
+  entry = metadataCache.get(name)
+  if (entry is not None) and (entry["key"] == key): return entry["value"]
+
+  value = compute()
+  metadataCache[name] = {"key" : key, "value" : value}
+  writeFileAtomically(metadataCacheFilePath, json.dumps(metadataCache, indent=2).encode())
+  return value
+
+
+
+def writeFileAtomically(filePath: pathlib.Path, contents: bytes) -> None:
+  filePath.parent.mkdir(parents=True, exist_ok=True)
+  fileDescriptor, tmpFilePathStr = tempfile.mkstemp(dir=filePath.parent,
+      prefix=f".{filePath.name}.")
+
+  try:
+    with os.fdopen(fileDescriptor, "wb") as f: f.write(contents)
+    os.replace(tmpFilePathStr, filePath)
+  except BaseException:
+    pathlib.Path(tmpFilePathStr).unlink(missing_ok=True)
+    raise
 
 
 
 def getToBeDownloadedVersions() -> Tuple[str, str]:
-  with open(repoDirPath.joinpath("src", "DependencyManager.ts"), "r") as f:
-    dependencyManagerTypescript = f.read()
+  metadata = getToBeDownloadedLtexLsMetadata()
+  return metadata["tag"], metadata["version"]
+
+def getToBeDownloadedHashDigests() -> Dict[str, str]:
+  hashDigests: Dict[str, str] = getToBeDownloadedLtexLsMetadata()["hashDigests"]
+  return hashDigests
+
+def getToBeDownloadedLtexLsMetadata() -> Dict[str, Any]:
+  dependencyManagerFilePath = repoDirPath.joinpath("src", "DependencyManager.ts")
+  metadata: Dict[str, Any] = getCachedMetadata("toBeDownloadedLtexLs", [dependencyManagerFilePath],
+      lambda: parseToBeDownloadedLtexLsMetadata(dependencyManagerFilePath))
+  return metadata
+
+def parseToBeDownloadedLtexLsMetadata(dependencyManagerFilePath: pathlib.Path) -> Dict[str, Any]:
+  with open(dependencyManagerFilePath, "r") as f: dependencyManagerTypescript = f.read()
 
   matches = re.findall(r"_toBeDownloadedLtexLsTag: string =\n *'(.*?)';",
       dependencyManagerTypescript)
@@ -37,40 +125,349 @@ def getToBeDownloadedVersions() -> Tuple[str, str]:
   assert len(matches) == 1
   toBeDownloadedLtexLsVersion = matches[0]
 
-  return toBeDownloadedLtexLsTag, toBeDownloadedLtexLsVersion
+  matches = re.findall(
+      r"_toBeDownloadedLtexLsHashDigests: \{\[fileName: string\]: string\} = \{\n(.*?)  \};\n",
+      dependencyManagerTypescript, flags=re.DOTALL)
+  assert len(matches) == 1
+  toBeDownloadedLtexLsHashDigests = dict(re.findall(r"'(.*?)':\n *'([0-9a-f]{64})',", matches[0]))
 
-toBeDownloadedLtexLsTag, toBeDownloadedLtexLsVersion = getToBeDownloadedVersions()
+  return {
+        "tag" : toBeDownloadedLtexLsTag,
+        "version" : toBeDownloadedLtexLsVersion,
+        "hashDigests" : toBeDownloadedLtexLsHashDigests,
+      }
 
 
 
 def getGitHubOrganizationRepository() -> Tuple[str, str]:
-  output = subprocess.run(["git", "remote", "get-url", "origin"],
-      cwd=pathlib.Path(__file__).parent.parent, stdout=subprocess.PIPE).stdout.decode()
-  regexMatch = re.search(r"github.com[:/](.*?)/(.*?)(?:\.git)?$", output)
-  assert regexMatch is not None, output
+  gitConfigFilePath = getGitConfigFilePath()
+  organization, repository = getCachedMetadata("gitHubOrganizationRepository",
+      [gitConfigFilePath], lambda: parseGitHubOrganizationRepository(gitConfigFilePath))
+  return organization, repository
+
+def parseGitHubOrganizationRepository(gitConfigFilePath: pathlib.Path) -> Tuple[str, str]:
+  remoteUrl = getGitRemoteUrlFromConfig(gitConfigFilePath, "origin")
+  regexMatch = (gitHubRemoteUrlRegex.search(remoteUrl) if remoteUrl is not None else None)
+
+  if regexMatch is None:
+    # fall back to Git for configurations we don't parse ourselves (e.g., includes or insteadOf)
+    remoteUrl = subprocess.run(["git", "remote", "get-url", "origin"],
+        cwd=repoDirPath, stdout=subprocess.PIPE).stdout.decode().strip()
+    regexMatch = gitHubRemoteUrlRegex.search(remoteUrl)
+
+  assert regexMatch is not None, remoteUrl
   organization, repository = regexMatch.group(1), regexMatch.group(2)
   return organization, repository
 
-organization, repository = getGitHubOrganizationRepository()
+def getGitConfigFilePath() -> pathlib.Path:
+  gitDirPath = repoDirPath.joinpath(".git")
 
+  if gitDirPath.is_file():
+    # in worktrees and submodules, .git is a file pointing to the actual Git directory
+    with open(gitDirPath, "r") as f: regexMatch = re.match(r"gitdir: (.*)", f.read().strip())
+    assert regexMatch is not None, f"Could not parse '{gitDirPath}'"
+    gitDirPath = repoDirPath.joinpath(regexMatch.group(1))
+    commonDirFilePath = gitDirPath.joinpath("commondir")
 
+    if commonDirFilePath.is_file():
+      with open(commonDirFilePath, "r") as f: gitDirPath = gitDirPath.joinpath(f.read().strip())
 
-def requestFromGitHub(url: str, decodeAsJson: bool = True,
-      method: Optional[str] = None, data: Optional[str] = None) -> Any:
+  return gitDirPath.joinpath("config")
+
+def getGitRemoteUrlFromConfig(gitConfigFilePath: pathlib.Path, remoteName: str) -> Optional[str]:
+  with open(gitConfigFilePath, "r") as f: gitConfigLines = f.read().splitlines()
+
+  isInRemoteSection = False
+
+  for gitConfigLine in gitConfigLines:
+    if (regexMatch := re.match(r"^\s*\[(.*?)\]", gitConfigLine)) is not None:
+      isInRemoteSection = (regexMatch.group(1) == f"remote \"{remoteName}\"")
+    elif isInRemoteSection and ((regexMatch := re.match(r"^\s*url\s*=\s*(.*?)\s*$",
+          gitConfigLine)) is not None):
+      return regexMatch.group(1)
+
+  return None
+
+
+
+class GitHubResponse(NamedTuple):
+  status: int
+  headers: http.client.HTTPMessage
+  body: bytes
+
+
+
+class GitHubSession:
+  _redirectStatuses = [301, 302, 303, 307, 308]
+  _maxNumberOfRedirects = 10
+  _maxNumberOfRateLimitRetries = 3
+  _staleConnectionErrors = (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+      BrokenPipeError, ConnectionResetError)
+
+  def __init__(self) -> None:
+    self._idleConnections: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def _getProxyUrl(scheme: str, host: str) -> Optional[urllib.parse.SplitResult]:
+    # honor the same proxy settings as urllib (e.g., the environment variable https_proxy)
+    proxyUrl = urllib.request.getproxies().get(scheme)
+    if (proxyUrl is None) or urllib.request.proxy_bypass(host): return None
+    if "://" not in proxyUrl: proxyUrl = f"http://{proxyUrl}"
+    parsedProxyUrl = urllib.parse.urlsplit(proxyUrl)
+
+    if parsedProxyUrl.scheme != "http":
+      raise ValueError(f"Unsupported proxy URL scheme '{parsedProxyUrl.scheme}'")
+
+    return parsedProxyUrl
+
+  @staticmethod
+  def _getProxyHeaders(proxyUrl: urllib.parse.SplitResult) -> Dict[str, str]:
+    if proxyUrl.username is None: return {}
+    credentials = "{}:{}".format(urllib.parse.unquote(proxyUrl.username),
+        urllib.parse.unquote(proxyUrl.password or ""))
+    return {"Proxy-Authorization" : "Basic {}".format(
+        base64.b64encode(credentials.encode()).decode())}
+
+  def _acquireConnection(self, scheme: str, host: str) -> Tuple[http.client.HTTPConnection, bool]:
+    with self._lock:
+      idleConnections = self._idleConnections.get((scheme, host), [])
+      if len(idleConnections) > 0: return idleConnections.pop(), True
+
+    if scheme not in ["http", "https"]: raise ValueError(f"Unsupported URL scheme '{scheme}'")
+    proxyUrl = self._getProxyUrl(scheme, host)
+    connectionClass = (http.client.HTTPSConnection if scheme == "https" else
+        http.client.HTTPConnection)
+
+    if proxyUrl is None: return connectionClass(host), False
+    connection = connectionClass(proxyUrl.netloc.rpartition("@")[2])
+
+    if scheme == "https":
+      # tunnel the TLS connection through the proxy with CONNECT
+      connection.set_tunnel(host, headers=self._getProxyHeaders(proxyUrl))
+
+    # otherwise, plain HTTP requests are sent to the proxy with the absolute URL, see _send
+    return connection, False
+
+  def _releaseConnection(self, scheme: str, host: str,
+        connection: http.client.HTTPConnection) -> None:
+    with self._lock: self._idleConnections.setdefault((scheme, host), []).append(connection)
+
+  def close(self) -> None:
+    with self._lock:
+      for idleConnections in self._idleConnections.values():
+        for connection in idleConnections: connection.close()
+
+      self._idleConnections.clear()
+
+  def _send(self, url: str, method: str, data: Optional[bytes],
+        headers: Dict[str, str]) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+    parsedUrl = urllib.parse.urlsplit(url)
+    path = urllib.parse.urlunsplit(("", "", parsedUrl.path or "/", parsedUrl.query, ""))
+    proxyUrl = (self._getProxyUrl(parsedUrl.scheme, parsedUrl.netloc)
+        if parsedUrl.scheme == "http" else None)
+
+    if proxyUrl is not None:
+      path = urllib.parse.urlunsplit(parsedUrl[:3] + (parsedUrl.query, ""))
+      headers = {**headers, **self._getProxyHeaders(proxyUrl)}
+
+    while True:
+      connection, isReused = self._acquireConnection(parsedUrl.scheme, parsedUrl.netloc)
+
+      try:
+        connection.request(method, path, body=data, headers=headers)
+        return connection, connection.getresponse()
+      except self._staleConnectionErrors:
+        connection.close()
+        # the server might have closed an idle keep-alive connection, so try again with a new one
+        if not isReused: raise
+
+  def _finish(self, url: str, connection: http.client.HTTPConnection,
+        response: http.client.HTTPResponse) -> None:
+    if response.will_close:
+      connection.close()
+    else:
+      parsedUrl = urllib.parse.urlsplit(url)
+      self._releaseConnection(parsedUrl.scheme, parsedUrl.netloc, connection)
+
+  @staticmethod
+  def _readAll(connection: http.client.HTTPConnection, response: http.client.HTTPResponse) -> bytes:
+    try:
+      body = response.read()
+    except BaseException:
+      connection.close()
+      raise
+
+    if response.headers.get("Content-Encoding", "").lower() == "gzip":
+      body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+    return body
+
+  @staticmethod
+  def _getRateLimitWaitTime(response: http.client.HTTPResponse) -> Optional[float]:
+    if "Retry-After" in response.headers:
+      retryAfter = response.headers["Retry-After"].strip()
+      # Retry-After is either a number of seconds or an HTTP date
+      if retryAfter.isdigit(): return float(retryAfter)
+
+      try:
+        retryDate = email.utils.parsedate_to_datetime(retryAfter)
+      except (TypeError, ValueError):
+        retryDate = None
+
+      if retryDate is not None:
+        if retryDate.tzinfo is None: retryDate = retryDate.replace(tzinfo=datetime.timezone.utc)
+        return max(retryDate.timestamp() - time.time(), 0.0) + 1.0
+
+    if (response.headers.get("X-RateLimit-Remaining") == "0") \
+          and ("X-RateLimit-Reset" in response.headers):
+      return max(float(response.headers["X-RateLimit-Reset"]) - time.time(), 0.0) + 1.0
+    else:
+      return None
+
+  def _open(self, url: str, method: Optional[str], data: Optional[bytes],
+        headers: Optional[Dict[str, str]]) -> Tuple[str, http.client.HTTPConnection,
+          http.client.HTTPResponse]:
+    method = (method if method is not None else ("GET" if data is None else "POST"))
+    headers = {
+          "Accept-Encoding" : "gzip",
+          "Connection" : "keep-alive",
+          "User-Agent" : "vscode-ltex-tools",
+          **(headers if headers is not None else {}),
+        }
+    host = urllib.parse.urlsplit(url).netloc
+    numberOfRedirects = 0
+    numberOfRateLimitRetries = 0
+
+    while numberOfRedirects <= self._maxNumberOfRedirects:
+      connection, response = self._send(url, method, data, headers)
+      rateLimitWaitTime = self._getRateLimitWaitTime(response)
+
+      if response.status in self._redirectStatuses:
+        numberOfRedirects += 1
+        self._readAll(connection, response)
+        self._finish(url, connection, response)
+        url = urllib.parse.urljoin(url, response.headers["Location"])
+
+        if (response.status == 303) or ((response.status in [301, 302]) and (method == "POST")):
+          method, data = "GET", None
+
+        if urllib.parse.urlsplit(url).netloc != host:
+          headers = {x : y for x, y in headers.items() if x != "Authorization"}
+      elif ((response.status in [403, 429]) and (rateLimitWaitTime is not None)
+            and (numberOfRateLimitRetries < self._maxNumberOfRateLimitRetries)):
+        numberOfRateLimitRetries += 1
+        self._readAll(connection, response)
+        self._finish(url, connection, response)
+        print(f"Hit rate limit of '{host}', retrying in {rateLimitWaitTime:.0f} seconds...")
+        time.sleep(rateLimitWaitTime)
+      elif response.status >= 400:
+        body = self._readAll(connection, response)
+        self._finish(url, connection, response)
+        raise urllib.error.HTTPError(url, response.status, response.reason, response.headers,
+            io.BytesIO(body))
+      else:
+        return url, connection, response
+
+    raise RuntimeError(f"Too many redirects for '{url}'")
+
+  def request(self, url: str, method: Optional[str] = None, data: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None) -> GitHubResponse:
+    url, connection, response = self._open(url, method, data, headers)
+    body = self._readAll(connection, response)
+    self._finish(url, connection, response)
+    return GitHubResponse(response.status, response.headers, body)
+
+  def stream(self, url: str, headers: Optional[Dict[str, str]] = None,
+        chunkSize: int = 1 << 16) -> Iterator[bytes]:
+    url, connection, response = self._open(url, None, None, headers)
+    decompressor = (zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if response.headers.get("Content-Encoding", "").lower() == "gzip" else None)
+    isFinished = False
+
+    try:
+      while len(chunk := response.read(chunkSize)) > 0:
+        yield (decompressor.decompress(chunk) if decompressor is not None else chunk)
+
+      if decompressor is not None: yield decompressor.flush()
+      isFinished = True
+    finally:
+      # connections whose response hasn't been read completely can't be reused
+      if isFinished:
+        self._finish(url, connection, response)
+      else:
+        connection.close()
+
+gitHubSession = GitHubSession()
+
+
+
+def getGitHubHeaders() -> Dict[str, str]:
   headers = {}
 
   if "LTEX_GITHUB_OAUTH_TOKEN" in os.environ:
     headers["Authorization"] = "token {}".format(os.environ["LTEX_GITHUB_OAUTH_TOKEN"])
 
-  apiRequest = urllib.request.Request(url, headers=headers,
-      data=(None if data is None else data.encode()), method=method)
+  return headers
+
+
+
+def handleGitHubHttpError(e: urllib.error.HTTPError) -> NoReturn:
+  traceback.print_exc()
+  print("Response body: \"{!r}\"".format(e.read()))
+  sys.exit(1)
+
+
 
+def requestFromGitHub(url: str, decodeAsJson: bool = True,
+      method: Optional[str] = None, data: Optional[str] = None) -> Any:
   try:
-    with urllib.request.urlopen(apiRequest) as f: response = f.read()
+    response = gitHubSession.request(url, method=method,
+        data=(None if data is None else data.encode()), headers=getGitHubHeaders()).body
   except urllib.error.HTTPError as e:
-    traceback.print_exc()
-    print("Response body: \"{!r}\"".format(e.read()))
-    sys.exit(1)
+    handleGitHubHttpError(e)
 
   if decodeAsJson: response = json.loads(response)
   return response
+
+
+
+def requestPagesFromGitHub(url: str) -> Iterator[List[Any]]:
+  nextUrl: Optional[str] = url
+
+  while nextUrl is not None:
+    try:
+      response = gitHubSession.request(nextUrl, headers=getGitHubHeaders())
+    except urllib.error.HTTPError as e:
+      handleGitHubHttpError(e)
+
+    yield json.loads(response.body)
+    regexMatch = re.search(r"<([^>]*)>;\s*rel=\"next\"", response.headers.get("Link", ""))
+    nextUrl = (regexMatch.group(1) if regexMatch is not None else None)
+
+
+
+def streamFromGitHub(url: str, chunkSize: int = 1 << 16) -> Iterator[bytes]:
+  try:
+    yield from gitHubSession.stream(url, headers=getGitHubHeaders(), chunkSize=chunkSize)
+  except urllib.error.HTTPError as e:
+    handleGitHubHttpError(e)
+
+
+
+def getUsedNlsKeysFromPackageJson(packageJson: Any) -> Set[str]:
+  # collect the keys of all "%key%" references with one iterative pass over the whole document
+  usedNlsKeys = set()
+  values = [packageJson]
+
+  while len(values) > 0:
+    value = values.pop()
+
+    if isinstance(value, dict):
+      values.extend(value.values())
+    elif isinstance(value, list):
+      values.extend(value)
+    elif isinstance(value, str) and value.startswith("%") and value.endswith("%"):
+      usedNlsKeys.add(value[1 : -1])
+
+  return usedNlsKeys
@@ -6,22 +6,103 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import abc
 import argparse
+import concurrent.futures
 import datetime
+import hashlib
+import io
+import itertools
+import json
 import pathlib
 import re
 import sys
-from typing import Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, TextIO, Tuple, cast
 import xml.etree.ElementTree as et
-import xml.dom.minidom
 
 sys.path.append(str(pathlib.Path(__file__).parent))
 import common
 
 
 
+changesNamespace = "{http://maven.apache.org/changes/1.0.0}"
+
+markdownHeader = """<!--
+   - Copyright (C) 2019-2021 Julian Valentin, LTeX Development Community
+   -
+   - This Source Code Form is subject to the terms of the Mozilla Public
+   - License, v. 2.0. If a copy of the MPL was not distributed with this
+   - file, You can obtain one at https://mozilla.org/MPL/2.0/.
+   -->
+
+"""
+markdownUpcomingFundamentalChanges = """
+## Upcoming Fundamental Changes
+
+- New versions of LT<sub>E</sub>X released on or after January 14, 2022, will require VS Code 1.61.0 or later
+"""
+
+actionTypeEmojis = {
+      "add" : "\u2728",
+      "fix": "\U0001f41b",
+      "remove" : "\U0001f5d1",
+      "update" : "\U0001f527",
+    }
+actionTypeNames = {"add" : "New", "fix": "Bug fix", "remove" : "Removal", "update" : "Change"}
+
+issueRegex = re.compile(r"(?:(.*?)/)?(.*?)?#([0-9]+)")
+userRegex = re.compile(r"@([^)]+)")
+texRegex = re.compile(r"(?<!`L)TeX")
+releaseHeadingRegex = re.compile(r"## ([^ ]+)(?: \u2014 \u201c(.*?)\u201d)? \((.*)\)")
+xmlRootStartTagRegex = re.compile(rb"<document\b[^>]*>")
+xmlTitleRegex = re.compile(rb"<title\b.*?</title>", re.DOTALL)
+xmlReleaseRegex = re.compile(rb"<release\b[^>]*?/>|<release\b.*?</release>", re.DOTALL)
+changelogIndexFilePath = common.cacheDirPath.joinpath("changelogIndex.json")
+# computed on first use
+moduleSourceHashDigest: Optional[str] = None
+# PR alternatives come first, as "[PR #1]" would also be a valid issue reference
+changeTokenRegex = re.compile(
+    r"(?P<openPr> \((?:\[PR |PR \[)(?P<openPrRef>[^\]]*?#[0-9]+)\]\([^)]*\) "
+      r"by \[(?P<openPrAuthor>[^\]]*?)\]\([^)]*\))"
+    r"|(?P<openIssue> \((?:fixes part of|fixes|see) \[(?P<openIssueRef>[^\]]*?#[0-9]+)\]\([^)]*\))"
+    r"|(?P<nextPr>(?:[;,]| and) \[PR (?P<nextPrRef>[^\]]*?#[0-9]+)\]\([^)]*\) "
+      r"by \[(?P<nextPrAuthor>[^\]]*?)\]\([^)]*\))"
+    r"|(?P<nextIssue>(?:[;,]| and) (?:fixes |see )?\[(?P<nextIssueRef>[^\]]*?#[0-9]+)\]\([^)]*\))"
+    r"|(?P<close>\))"
+    r"|(?P<fixKeyword>(?i:error|warning|prevent))"
+    r"|(?P<addKeyword>(?i:support))")
+
+
+
+class XmlEntityTable(Dict[int, str]):
+  # str.translate() table that lazily maps every code point from U+007F on to an XML entity,
+  # optionally escaping markup characters as well
+  def __init__(self, markup: Optional[Dict[str, str]] = None) -> None:
+    super().__init__((x, chr(x)) for x in range(0x7f))
+    if markup is not None: self.update((ord(x), y) for x, y in markup.items())
+
+  def __missing__(self, codePoint: int) -> str:
+    entity = f"&#x{codePoint:04x};"
+    self[codePoint] = entity
+    return entity
+
+xmlEntityTable = XmlEntityTable()
+xmlEscapeTable = XmlEntityTable({"&" : "&amp;", "<" : "&lt;", "\"" : "&quot;", ">" : "&gt;"})
+
+xmlHeader = """<?xml version="1.0" encoding="UTF-8"?>
+<!--
+   - Copyright (C) 2019-2021 Julian Valentin, LTeX Development Community
+   -
+   - This Source Code Form is subject to the terms of the Mozilla Public
+   - License, v. 2.0. If a copy of the MPL was not distributed with this
+   - file, You can obtain one at https://mozilla.org/MPL/2.0/.
+   -->
+"""
+
+
+
 def parseIssue(issue: str) -> Tuple[str, str, int, str]:
-  issueMatch = re.search(r"(?:(.*?)/)?(.*?)?#([0-9]+)", issue)
+  issueMatch = issueRegex.search(issue)
   assert issueMatch is not None, issue
   issueOrganization = (issueMatch.group(1) if issueMatch.group(1) is not None else
       common.organization)
@@ -41,200 +122,614 @@ def parseIssue(issue: str) -> Tuple[str, str, int, str]:
 
 
 def replaceUnicodeWithXmlEntities(string: str) -> str:
-  return re.sub(r"[\u007f-\U0010ffff]", (lambda x: f"&#x{ord(x.group()):04x};"), string)
+  return string.translate(xmlEntityTable)
 
 
 
-def convertChangelogFromXmlToMarkdown(xmlFilePath: pathlib.Path,
-      version: Optional[str] = None) -> str:
-  document = et.parse(xmlFilePath).getroot()
+class ChangelogAction:
+  __slots__ = ["type", "issues", "authors", "text"]
 
-  if version is None:
-    markdown = """<!--
-   - Copyright (C) 2019-2021 Julian Valentin, LTeX Development Community
-   -
-   - This Source Code Form is subject to the terms of the Mozilla Public
-   - License, v. 2.0. If a copy of the MPL was not distributed with this
-   - file, You can obtain one at https://mozilla.org/MPL/2.0/.
-   -->
+  def __init__(self, type_: str, issues: List[str], authors: List[str], text: str) -> None:
+    self.type = type_
+    self.issues = issues
+    self.authors = authors
+    self.text = text
 
-"""
+  @staticmethod
+  def fromElement(action: et.Element) -> "ChangelogAction":
+    issues = action.attrib["issue"].split(",") if "issue" in action.attrib else []
+    authors = action.attrib["due-to"].split(",") if "due-to" in action.attrib else []
+    assert action.text is not None
+    return ChangelogAction(action.attrib["type"], issues, authors, action.text.strip())
 
-    title = document.findtext("./{http://maven.apache.org/changes/1.0.0}properties"
-        "/{http://maven.apache.org/changes/1.0.0}title")
-    markdown += f"# {title}\n"
-    markdown += """
-## Upcoming Fundamental Changes
 
-- New versions of LT<sub>E</sub>X released on or after January 14, 2022, will require VS Code 1.61.0 or later
-"""
-  else:
-    markdown = ""
 
-  releases = document.findall("./{http://maven.apache.org/changes/1.0.0}body"
-      "/{http://maven.apache.org/changes/1.0.0}release")
+class ChangelogRelease:
+  __slots__ = ["version", "description", "date", "actions"]
 
-  for release in releases:
-    curVersion = release.attrib["version"]
-    if version == "latest": version = curVersion
-    if (version is not None) and (curVersion != version): continue
+  def __init__(self, version: str, description: str, date: str,
+        actions: List[ChangelogAction]) -> None:
+    self.version = version
+    self.description = description
+    self.date = date
+    self.actions = actions
 
-    description = release.attrib.get("description", "")
-    if len(description) > 0: description = f" \u2014 \u201c{description}\u201d"
-    dateStr = release.attrib["date"]
-    dateStr = (
-        datetime.datetime.strptime(dateStr, "%Y-%m-%d").strftime("%B %d, %Y").replace(" 0", " ")
-        if dateStr != "upcoming" else dateStr)
-    if version is None: markdown += f"\n## {curVersion}{description} ({dateStr})\n\n"
-
-    for action in release.findall("./{http://maven.apache.org/changes/1.0.0}action"):
-      type_ = action.attrib["type"]
-      typeEmoji = {
-            "add" : "\u2728",
-            "fix": "\U0001f41b",
-            "remove" : "\U0001f5d1",
-            "update" : "\U0001f527",
-          }[type_]
-      typeStr = {"add" : "New", "fix": "Bug fix", "remove" : "Removal", "update" : "Change"}[type_]
-
-      additionalInfo = ""
-
-      if "issue" in action.attrib:
-        for issue in action.attrib["issue"].split(","):
-          issueOrganization, issueRepository, issueNumber, issue = parseIssue(issue)
-          additionalInfo += (" \u2014 " if additionalInfo == "" else ", ")
-          additionalInfo += (f"[{issue}](https://github.com/{issueOrganization}/"
-              f"{issueRepository}/issues/{issueNumber})")
-
-      if "due-to" in action.attrib:
-        for author in action.attrib["due-to"].split(","):
-          additionalInfo += (" \u2014 " if additionalInfo == "" else ", ")
-          userMatch = re.search(r"@([^)]+)", author)
-          if userMatch is not None: author = f"[{author}](https://github.com/{userMatch.group(1)})"
-          additionalInfo += author
-
-      change = action.text
-      assert change is not None
-      change = change.strip()
-      change = change.replace("LaTeX", "L<sup>A</sup>T<sub>E</sub>X")
-      change = re.sub(r"(?<!`L)TeX", "T<sub>E</sub>X", change)
-
-      markdown += f"- {typeEmoji} *{typeStr}:* {change}{additionalInfo}\n"
-
-  markdown = replaceUnicodeWithXmlEntities(markdown)
-  return markdown
-
-
-
-def convertReleaseFromMarkdownToXml(body: et.Element, version: str, name: str, dateStr: str,
-      changes: str) -> et.Element:
-  attributes = {"version" : version}
-  if len(name) > 0: attributes["description"] = name
-  attributes["date"] = (datetime.datetime.strptime(dateStr, "%B %d, %Y").strftime("%Y-%m-%d")
-      if dateStr != "upcoming" else dateStr)
-  release = et.SubElement(body, "release", attributes)
+  @property
+  def isUpcoming(self) -> bool:
+    return self.date == "upcoming"
 
-  changes = changes.strip()
+  @staticmethod
+  def fromElement(release: et.Element) -> "ChangelogRelease":
+    return ChangelogRelease(release.attrib["version"], release.attrib.get("description", ""),
+        release.attrib["date"], [ChangelogAction.fromElement(x)
+          for x in release.iterfind(f"./{changesNamespace}action")])
 
-  for change in changes.split("\n"):
-    change = re.sub(r"^- ", "", change).strip()
-    attributes = {}
-
-    if change.startswith("Remove "):
-      attributes["type"] = "remove"
-    elif (change.startswith("Add ") or ("support" in change.lower())
-          or (change == "Initial release")):
-      attributes["type"] = "add"
-    elif (change.startswith("Fix ")
-          or any(x in change.lower() for x in ["error", "warning", "prevent"])):
-      attributes["type"] = "fix"
+
+
+class Changelog:
+  __slots__ = ["title", "author", "releases"]
+
+  def __init__(self, title: str, author: str, releases: List[ChangelogRelease]) -> None:
+    self.title = title
+    self.author = author
+    self.releases = releases
+
+
+
+class ChangelogReader:
+  # reads changelog.xml incrementally, dropping every release after it has been processed, so
+  # that memory usage stays flat and queries for the first releases only read the top of the file
+  def __init__(self, xmlFilePath: pathlib.Path) -> None:
+    self.xmlFilePath = xmlFilePath
+
+  def getProperties(self) -> Dict[str, str]:
+    properties = {}
+
+    with open(self.xmlFilePath, "rb") as f:
+      for _, element in et.iterparse(f):
+        if element.tag == f"{changesNamespace}properties": break
+        properties[element.tag[len(changesNamespace):]] = element.text or ""
+
+    return properties
+
+  def iterReleases(self) -> Iterator[ChangelogRelease]:
+    with open(self.xmlFilePath, "rb") as f:
+      body: Optional[et.Element] = None
+
+      for event, element in et.iterparse(f, ["start", "end"]):
+        if event == "start":
+          if element.tag == f"{changesNamespace}body": body = element
+        elif element.tag == f"{changesNamespace}release":
+          yield ChangelogRelease.fromElement(element)
+          if body is not None: body.clear()
+
+  def findRelease(self, version: str) -> Optional[ChangelogRelease]:
+    # "latest" is the first release, even if it is upcoming
+    for release in self.iterReleases():
+      if (version == "latest") or (release.version == version): return release
+
+    return None
+
+
+
+def parseXmlFragment(rootStartTag: bytes, fragment: bytes) -> et.Element:
+  # wrap the fragment in the start tag of the root to get the namespace declarations right
+  return et.fromstring(rootStartTag + fragment + b"</document>")[0]
+
+
+
+def getChangelogIndexKey(xml: bytes) -> List[Any]:
+  # the index only depends on the contents of the changelog (not on its path, as it's also
+  # converted in temporary staging directories), on the code that renders it, and on the
+  # organization and repository used in the Markdown
+  global moduleSourceHashDigest
+
+  if moduleSourceHashDigest is None:
+    with open(__file__, "rb") as f: moduleSourceHashDigest = hashlib.sha256(f.read()).hexdigest()
+
+  return [hashlib.sha256(xml).hexdigest(), moduleSourceHashDigest,
+      common.organization, common.repository]
+
+
+
+def loadChangelogIndexFromCache() -> Optional[Dict[str, Any]]:
+  try:
+    with open(changelogIndexFilePath, "r") as f: index = json.load(f)
+  except (OSError, ValueError):
+    return None
+
+  return (cast(Dict[str, Any], index) if isinstance(index, dict) and ("key" in index) else None)
+
+
+
+def loadChangelogIndex(xmlFilePath: pathlib.Path) -> Optional[Dict[str, Any]]:
+  # returns None if there is no up-to-date index
+  with open(xmlFilePath, "rb") as f: xml = f.read()
+  index = loadChangelogIndexFromCache()
+  return (index if (index is not None) and (index["key"] == getChangelogIndexKey(xml)) else None)
+
+
+
+def getChangelogIndex(xmlFilePath: pathlib.Path) -> Dict[str, Any]:
+  # the index lists version, description, date, content hash, and rendered Markdown of every
+  # release of the changelog; only the index of the last converted changelog is kept in the
+  # tools cache
+  with open(xmlFilePath, "rb") as f: xml = f.read()
+  key = getChangelogIndexKey(xml)
+  oldIndex = loadChangelogIndexFromCache()
+  if (oldIndex is not None) and (oldIndex["key"] == key): return oldIndex
+
+  # only re-render releases whose contents changed (and only if the rendering did not change)
+  oldReleases = ({x["hash"] : x for x in oldIndex["releases"]}
+      if (oldIndex is not None) and (oldIndex["key"][1:] == key[1:]) else {})
+
+  rootStartTagMatch = xmlRootStartTagRegex.search(xml)
+  assert rootStartTagMatch is not None
+  rootStartTag = rootStartTagMatch.group()
+  titleMatch = xmlTitleRegex.search(xml, rootStartTagMatch.end())
+  title = (parseXmlFragment(rootStartTag, titleMatch.group()).text
+      if titleMatch is not None else None)
+  releases = []
+
+  for releaseMatch in xmlReleaseRegex.finditer(xml, rootStartTagMatch.end()):
+    hashDigest = hashlib.sha256(releaseMatch.group()).hexdigest()
+    entry = oldReleases.get(hashDigest)
+
+    if entry is None:
+      release = ChangelogRelease.fromElement(parseXmlFragment(rootStartTag, releaseMatch.group()))
+      entry = {
+            "version" : release.version,
+            "description" : release.description,
+            "date" : release.date,
+            "hash" : hashDigest,
+            "heading" : markdownChangelogRenderer.renderReleaseHeading(release),
+            "markdown" : markdownChangelogRenderer.renderRelease(release),
+          }
+
+    releases.append(entry)
+
+  index = {"key" : key, "title" : title, "releases" : releases}
+  common.writeFileAtomically(changelogIndexFilePath, json.dumps(index).encode())
+  return index
+
+
+
+def convertChangelogFromXmlToMarkdown(xmlFilePath: pathlib.Path,
+      version: Optional[str] = None) -> str:
+  # the index only caches the output of MarkdownChangelogRenderer for every release
+  if version is not None:
+    # without an up-to-date index, rendering a single release is cheaper than building one
+    index = loadChangelogIndex(xmlFilePath)
+
+    if index is None:
+      return renderChangelog(parseChangelogFromXml(xmlFilePath, version), "markdown", version)
+
+    entry = next((x for x in index["releases"]
+        if (version == "latest") or (x["version"] == version)), None)
+    return entry["markdown"] if entry is not None else ""
+
+  index = getChangelogIndex(xmlFilePath)
+  return MarkdownChangelogRenderer.joinDocument(index["title"],
+      ((x["heading"], x["markdown"]) for x in index["releases"]))
+
+
+
+def parseChangeFromMarkdown(change: str) -> Tuple[str, str, List[str], List[str]]:
+  # scan the change once: references are cut out (a group opened by " (fixes [...](...)" only
+  # if it is closed right after its last reference) and type keywords are recorded on the way
+  pieces: List[str] = []
+  issues: List[str] = []
+  authors: List[str] = []
+  keywords: Set[str] = set()
+  position = 0
+  group: List[re.Match[str]] = []
+
+  def addReference(match: re.Match[str]) -> None:
+    nonlocal position
+    assert match.lastgroup is not None
+    pieces.append(change[position:match.start()])
+    position = match.end()
+    _, _, _, issue = parseIssue(match.group(f"{match.lastgroup}Ref"))
+    issues.append(issue)
+    if match.lastgroup.endswith("Pr"): authors.append(match.group(f"{match.lastgroup}Author"))
+
+  def closeGroup(closeMatch: Optional[re.Match[str]]) -> None:
+    nonlocal position
+    if closeMatch is not None:
+      for match in group: addReference(match)
+      position = closeMatch.end()
     else:
-      attributes["type"] = "update"
-
-    issues = []
-    authors = []
-    issueFound = True
-
-    while issueFound:
-      issueMatch1 = re.search(
-          r" \((?:fixes|fixes part of|see) \[([^\]]*?#[0-9]+)\]\(.*?\)\)", change)
-      issueMatch2 = re.search(
-          r"(?:[;,]| and) (?:fixes |see )?\[([^\]]*?#[0-9]+)\]\(.*?\)", change)
-      issueMatch3 = re.search(
-          r" \((?:\[PR |PR \[)(.*?#[0-9]+)\]\([^\]]*?\) by \[([^\]]*?)\]\(.*?\)\)", change)
-      issueMatch4 = re.search(
-          r"(?:[;,]| and) \[PR (.*?#[0-9]+)\]\([^\]]*?\) by \[([^\]]*?)\]\(.*?\)", change)
-      issueFound = False
-
-      for issueMatch in [issueMatch1, issueMatch2, issueMatch3, issueMatch4]:
-        if issueMatch is not None:
-          issueFound = True
-          _, _, _, issue = parseIssue(issueMatch.group(1))
-          issues.append(issue)
-          if len(issueMatch.groups()) > 1: authors.append(issueMatch.group(2))
-          change = change[:issueMatch.start()] + change[issueMatch.end():]
-
-    if len(issues) > 0: attributes["issue"] = ",".join(sorted(issues))
-    if len(authors) > 0: attributes["due-to"] = ",".join(sorted(authors))
+      # unclosed group: the opening reference stays text, the others are standalone references
+      for match in group[1:]: addReference(match)
+
+    group.clear()
+
+  for match in changeTokenRegex.finditer(change):
+    kind = match.lastgroup
+    assert kind is not None
+    if (len(group) > 0) and (match.start() != group[-1].end()): closeGroup(None)
+
+    if kind.endswith("Keyword"):
+      keywords.add(kind)
+    elif kind == "close":
+      if len(group) > 0: closeGroup(match)
+    elif kind.startswith("open"):
+      if len(group) > 0: closeGroup(None)
+      group.append(match)
+    elif len(group) > 0:
+      group.append(match)
+    else:
+      addReference(match)
+
+  if len(group) > 0: closeGroup(None)
+  text = "".join(pieces) + change[position:]
+
+  if change.startswith("Remove "):
+    type_ = "remove"
+  elif (change.startswith("Add ") or ("addKeyword" in keywords)
+        or (change == "Initial release")):
+    type_ = "add"
+  elif change.startswith("Fix ") or ("fixKeyword" in keywords):
+    type_ = "fix"
+  else:
+    type_ = "update"
+
+  return type_, text, issues, authors
 
+
+
+def parseReleaseFromMarkdown(version: str, name: str, dateStr: str,
+      changes: str) -> ChangelogRelease:
+  date = (datetime.datetime.strptime(dateStr, "%B %d, %Y").strftime("%Y-%m-%d")
+      if dateStr != "upcoming" else dateStr)
+  actions = []
+
+  for change in changes.strip().split("\n"):
+    change = re.sub(r"^- ", "", change).strip()
+    type_, change, issues, authors = parseChangeFromMarkdown(change)
     change = change.replace("T<sub>E</sub>X", "TeX").replace("L<sup>A</sup>", "La")
 
     assert f"github.com/{common.organization}" not in change, change
     assert "  -" not in change, change
 
-    action = et.SubElement(release, "action", attributes)
-    action.text = f"\n        {change}\n      "
+    actions.append(ChangelogAction(type_, sorted(issues), sorted(authors), change))
+
+  return ChangelogRelease(version, name, date, actions)
+
+
+
+def parseReleasesFromMarkdown(lines: Iterable[str]) -> Iterator[Tuple[str, str, str, str]]:
+  release: Optional[Tuple[str, str, str]] = None
+  headingMatch: Optional[re.Match[str]] = None
+  changeLines: List[str] = []
 
-  return release
+  for lineNumber, line in enumerate(lines):
+    line = line.rstrip("\n")
+
+    if line.startswith("## "):
+      if release is not None: yield release + ("\n".join(changeLines),)
+      release = None
+      headingMatch = (releaseHeadingRegex.fullmatch(line) if lineNumber > 0 else None)
+    elif headingMatch is not None:
+      # release headings have to be followed by an empty line
+      if line == "":
+        release = (headingMatch.group(1), headingMatch.group(2) or "", headingMatch.group(3))
+        changeLines = []
+
+      headingMatch = None
+    elif release is not None:
+      changeLines.append(line)
+
+  if release is not None: yield release + ("\n".join(changeLines),)
+
+
+
+def writeXmlElement(element: et.Element, output: TextIO, indentation: str = "") -> None:
+  # same layout as minidom's toprettyxml(indent="  "): elements with only text are written on
+  # one line, all other nodes on lines of their own
+  output.write(f"{indentation}<{element.tag}")
+
+  for name, value in element.attrib.items():
+    output.write(f" {name}=\"{value.translate(xmlEscapeTable)}\"")
+
+  if len(element) == 0:
+    if element.text:
+      output.write(f">{element.text.translate(xmlEscapeTable)}</{element.tag}>\n")
+    else:
+      output.write("/>\n")
+    return
+
+  output.write(">\n")
+  childIndentation = f"{indentation}  "
+  if element.text: output.write(f"{childIndentation}{element.text.translate(xmlEscapeTable)}\n")
+
+  for child in element:
+    writeXmlElement(child, output, childIndentation)
+    if child.tail: output.write(f"{childIndentation}{child.tail.translate(xmlEscapeTable)}\n")
+
+  output.write(f"{indentation}</{element.tag}>\n")
+
+
+
+def parseChangelogFromXml(xmlFilePath: pathlib.Path,
+      version: Optional[str] = None) -> Changelog:
+  reader = ChangelogReader(xmlFilePath)
+  properties = reader.getProperties()
+
+  if version is None:
+    releases = list(reader.iterReleases())
+  else:
+    release = reader.findRelease(version)
+    releases = [release] if release is not None else []
+
+  return Changelog(properties.get("title", ""), properties.get("author", ""), releases)
+
+
+
+def parseChangelogFromMarkdown(markdownFilePath: pathlib.Path,
+      version: Optional[str] = None) -> Changelog:
+  releases = []
+
+  with open(markdownFilePath, "r") as f:
+    for curVersion, name, dateStr, changes in parseReleasesFromMarkdown(f):
+      if version == "latest": version = curVersion
+      if (version is not None) and (curVersion != version): continue
+      releases.append(parseReleaseFromMarkdown(curVersion, name, dateStr, changes))
+      if version is not None: break
+
+  return Changelog("Changelog", "Julian Valentin, LTeX Development Community", releases)
+
+
+
+class ChangelogRenderer(abc.ABC):
+  # renders the whole changelog or the notes of a single release (e.g., for GitHub releases)
+  fileExtension = ""
+
+  @abc.abstractmethod
+  def renderDocument(self, changelog: Changelog) -> str:
+    pass
+
+  @abc.abstractmethod
+  def renderRelease(self, release: ChangelogRelease) -> str:
+    pass
+
+
+
+class MarkdownChangelogRenderer(ChangelogRenderer):
+  fileExtension = "md"
+
+  def renderDocument(self, changelog: Changelog) -> str:
+    return self.joinDocument(changelog.title,
+        ((self.renderReleaseHeading(x), self.renderRelease(x)) for x in changelog.releases))
+
+  @staticmethod
+  def joinDocument(title: str, releases: Iterable[Tuple[str, str]]) -> str:
+    # releases are pairs of rendered heading and rendered notes
+    markdown = [markdownHeader, f"# {title}\n".translate(xmlEntityTable),
+        markdownUpcomingFundamentalChanges]
+
+    for heading, notes in releases:
+      markdown.append(heading)
+      markdown.append(notes)
+
+    return "".join(markdown)
+
+  @staticmethod
+  def renderReleaseHeading(release: ChangelogRelease) -> str:
+    description = release.description
+    if len(description) > 0: description = f" \u2014 \u201c{description}\u201d"
+    dateStr = release.date
+
+    if not release.isUpcoming:
+      date = datetime.datetime.strptime(release.date, "%Y-%m-%d")
+      dateStr = date.strftime("%B %d, %Y").replace(" 0", " ")
+
+    return f"\n## {release.version}{description} ({dateStr})\n\n".translate(xmlEntityTable)
+
+  def renderRelease(self, release: ChangelogRelease) -> str:
+    markdown = []
+
+    for action in release.actions:
+      additionalInfo = []
+
+      for issue in action.issues:
+        issueOrganization, issueRepository, issueNumber, issue = parseIssue(issue)
+        additionalInfo.append(f"[{issue}](https://github.com/{issueOrganization}/"
+            f"{issueRepository}/issues/{issueNumber})")
+
+      for author in action.authors:
+        userMatch = userRegex.search(author)
+        if userMatch is not None: author = f"[{author}](https://github.com/{userMatch.group(1)})"
+        additionalInfo.append(author)
+
+      change = action.text.replace("LaTeX", "L<sup>A</sup>T<sub>E</sub>X")
+      change = texRegex.sub("T<sub>E</sub>X", change)
+
+      markdown.append(f"- {actionTypeEmojis[action.type]} *{actionTypeNames[action.type]}:* "
+          f"{change}")
+      if len(additionalInfo) > 0: markdown.append(" \u2014 " + ", ".join(additionalInfo))
+      markdown.append("\n")
+
+    return "".join(markdown).translate(xmlEntityTable)
+
+
+
+class XmlChangelogRenderer(ChangelogRenderer):
+  fileExtension = "xml"
+
+  def renderDocument(self, changelog: Changelog) -> str:
+    document = et.Element("document", {
+          "xmlns" : "http://maven.apache.org/changes/1.0.0",
+          "xmlns:xsi" : "http://www.w3.org/2001/XMLSchema-instance",
+          "xsi:schemaLocation" : "http://maven.apache.org/changes/1.0.0 "
+            "https://maven.apache.org/xsd/changes-1.0.0.xsd"
+        })
+
+    properties = et.SubElement(document, "properties")
+    title = et.SubElement(properties, "title")
+    title.text = changelog.title
+    author = et.SubElement(properties, "author")
+    author.text = changelog.author
+
+    body = et.SubElement(document, "body")
+    for release in changelog.releases: body.append(self.convertReleaseToElement(release))
+
+    xml = io.StringIO()
+    xml.write(xmlHeader)
+    writeXmlElement(document, xml)
+    return xml.getvalue()
+
+  def renderRelease(self, release: ChangelogRelease) -> str:
+    xml = io.StringIO()
+    writeXmlElement(self.convertReleaseToElement(release), xml)
+    return xml.getvalue()
+
+  @staticmethod
+  def convertReleaseToElement(release: ChangelogRelease) -> et.Element:
+    attributes = {"version" : release.version}
+    if len(release.description) > 0: attributes["description"] = release.description
+    attributes["date"] = release.date
+    element = et.Element("release", attributes)
+
+    for action in release.actions:
+      attributes = {"type" : action.type}
+      if len(action.issues) > 0: attributes["issue"] = ",".join(action.issues)
+      if len(action.authors) > 0: attributes["due-to"] = ",".join(action.authors)
+      et.SubElement(element, "action", attributes).text = f"\n        {action.text}\n      "
+
+    return element
+
+
+
+class JsonChangelogRenderer(ChangelogRenderer):
+  fileExtension = "json"
+
+  def renderDocument(self, changelog: Changelog) -> str:
+    return json.dumps({"title" : changelog.title, "author" : changelog.author,
+        "releases" : [self.convertReleaseToJson(x) for x in changelog.releases]}, indent=2) + "\n"
+
+  def renderRelease(self, release: ChangelogRelease) -> str:
+    return json.dumps(self.convertReleaseToJson(release), indent=2) + "\n"
+
+  @staticmethod
+  def convertReleaseToJson(release: ChangelogRelease) -> Dict[str, Any]:
+    return {
+          "version" : release.version,
+          "description" : release.description,
+          "date" : release.date,
+          "actions" : [{"type" : x.type, "issues" : x.issues, "authors" : x.authors,
+            "text" : x.text} for x in release.actions],
+        }
+
+
+
+markdownChangelogRenderer = MarkdownChangelogRenderer()
+changelogRenderers: Dict[str, ChangelogRenderer] = {
+      "markdown" : markdownChangelogRenderer,
+      "xml" : XmlChangelogRenderer(),
+      "json" : JsonChangelogRenderer(),
+    }
+
+
+
+def renderChangelog(changelog: Changelog, format_: str, version: Optional[str] = None) -> str:
+  # with a version, only the (already selected) release is rendered, without the document around it
+  renderer = changelogRenderers[format_]
+  if version is None: return renderer.renderDocument(changelog)
+  return "".join(renderer.renderRelease(x) for x in changelog.releases)
+
+
+
+def renderChangelogInFormats(changelog: Changelog, formats: Sequence[str],
+      version: Optional[str] = None, numberOfJobs: int = 1) -> List[str]:
+  if (numberOfJobs <= 1) or (len(formats) <= 1):
+    return [renderChangelog(changelog, x, version) for x in formats]
+
+  with concurrent.futures.ProcessPoolExecutor(min(numberOfJobs, len(formats))) as executor:
+    return list(executor.map(renderChangelog, itertools.repeat(changelog), formats,
+        itertools.repeat(version)))
+
+
+
+def selectReleases(changelog: Changelog, versions: str) -> List[ChangelogRelease]:
+  # versions is "all" or a comma-separated list of versions (including "latest") and semver
+  # constraints (e.g., ">=12.0.0,<13.0.0"); a release is selected if it is listed or matches
+  # all constraints
+  if versions == "all": return list(changelog.releases)
+
+  # only needed here, so that semver is not required for converting the changelog when packaging
+  import semver
+
+  listedVersions = set()
+  unknownVersions = []
+  constraints = []
+  releaseVersions = set(x.version for x in changelog.releases)
+
+  for version in versions.split(","):
+    version = version.strip()
+
+    if version == "latest":
+      if len(changelog.releases) > 0:
+        listedVersions.add(changelog.releases[0].version)
+      else:
+        unknownVersions.append(version)
+    elif version[:1] in ["<", ">", "=", "!"]:
+      constraints.append(version)
+    elif version in releaseVersions:
+      listedVersions.add(version)
+    elif version != "":
+      unknownVersions.append(version)
+
+  if len(unknownVersions) > 0:
+    raise ValueError("Unknown version(s) {}".format(", ".join(f"'{x}'" for x in unknownVersions)))
+
+  return [x for x in changelog.releases if (x.version in listedVersions)
+      or ((len(constraints) > 0)
+        and all(semver.VersionInfo.parse(x.version).match(y) for y in constraints))]
+
+
+
+def renderRelease(format_: str, release: ChangelogRelease) -> str:
+  return changelogRenderers[format_].renderRelease(release)
+
+
+
+def exportReleases(releases: Sequence[ChangelogRelease], formats: Sequence[str],
+      outputDirPath: pathlib.Path, numberOfJobs: int = 1) -> List[pathlib.Path]:
+  # writes one file per release and format, e.g., "12.0.0.md"
+  outputDirPath.mkdir(parents=True, exist_ok=True)
+  tasks = [(x, y) for x in formats for y in releases]
+
+  if (numberOfJobs <= 1) or (len(tasks) <= 1):
+    outputs = [renderRelease(x, y) for x, y in tasks]
+  else:
+    with concurrent.futures.ProcessPoolExecutor(numberOfJobs) as executor:
+      outputs = list(executor.map(renderRelease, [x for x, _ in tasks], [y for _, y in tasks],
+          chunksize=max(len(tasks) // (4 * numberOfJobs), 1)))
+
+  outputFilePaths = []
+
+  for (format_, release), output in zip(tasks, outputs):
+    outputFilePath = outputDirPath.joinpath(
+        f"{release.version}.{changelogRenderers[format_].fileExtension}")
+    with open(outputFilePath, "w") as f: f.write(output)
+    outputFilePaths.append(outputFilePath)
+
+  return outputFilePaths
 
 
 
 def convertChangelogFromMarkdownToXml(markdownFilePath: pathlib.Path,
       version: Optional[str] = None) -> str:
-  with open(markdownFilePath, "r") as f: changelog = f.read()
-
-  document = et.Element("document", {
-        "xmlns" : "http://maven.apache.org/changes/1.0.0",
-        "xmlns:xsi" : "http://www.w3.org/2001/XMLSchema-instance",
-        "xsi:schemaLocation" : "http://maven.apache.org/changes/1.0.0 "
-          "https://maven.apache.org/xsd/changes-1.0.0.xsd"
-      })
-
-  properties = et.SubElement(document, "properties")
-  title = et.SubElement(properties, "title")
-  title.text = "Changelog"
-  author = et.SubElement(properties, "author")
-  author.text = "Julian Valentin, LTeX Development Community"
-
-  body = et.SubElement(document, "body")
-
-  regexMatches = re.findall(
-      r"\n## ([^ ]+)(?: \u2014 \u201c(.*?)\u201d)? \((.*)\)\n\n((?:.|\n)+?)(?=$|\n## )", changelog)
-  for regexMatch in regexMatches:
-    curVersion = regexMatch[0]
-    if version == "latest": version = curVersion
-    if (version is not None) and (curVersion != version): continue
-    release = convertReleaseFromMarkdownToXml(body, *regexMatch)
-
-    if version is not None:
-      document = release
-      break
-
-  xmlStr = et.tostring(document, encoding="unicode", xml_declaration=True)
-  xmlStr = xml.dom.minidom.parseString(xmlStr).toprettyxml(indent="  ")
-  xmlStr = re.sub(r"^<\?xml version=\"1.0\" \?>\n",
-      ("""<?xml version="1.0" encoding="UTF-8"?>
-<!--
-   - Copyright (C) 2019-2021 Julian Valentin, LTeX Development Community
-   -
-   - This Source Code Form is subject to the terms of the Mozilla Public
-   - License, v. 2.0. If a copy of the MPL was not distributed with this
-   - file, You can obtain one at https://mozilla.org/MPL/2.0/.
-   -->
-""" if version is None else ""), xmlStr)
-  xmlStr = replaceUnicodeWithXmlEntities(xmlStr)
+  return renderChangelog(parseChangelogFromMarkdown(markdownFilePath, version), "xml", version)
 
-  return xmlStr
+
+
+def writeOutputFile(outputFilePath: pathlib.Path, output: str) -> None:
+  if str(outputFilePath) == "-":
+    print(output, end="")
+  else:
+    with open(outputFilePath, "w") as f: f.write(output)
 
 
 
@@ -247,22 +742,71 @@ def main() -> None:
       help="Markdown file to convert to XML")
   parser.add_argument("--output-file", type=pathlib.Path, default=pathlib.Path("-"), metavar="PATH",
       help="Output file; '-' is standard output (default)")
-  parser.add_argument("--version",
+  versionGroup = parser.add_mutually_exclusive_group()
+  versionGroup.add_argument("--version",
       help="Version to convert; 'latest' is permitted; all versions are converted if omitted")
+  versionsArgument = versionGroup.add_argument("--versions", metavar="VERSIONS",
+      help="Export several releases to --output-dir, one file per release and format; "
+        "VERSIONS is 'all' or a comma-separated list of versions and semver constraints, "
+        "e.g., '12.0.0,>=13.0.0'")
+  parser.add_argument("--output-dir", type=pathlib.Path, metavar="PATH",
+      help="Output directory for --versions")
+  formatArgument = parser.add_argument("--format", action="append", metavar="FORMAT[=PATH]",
+      help="Output format ('markdown', 'xml', or 'json'), optionally with its own output file; "
+        "can be given multiple times to render several formats from one parse "
+        "(default: Markdown for --xml-file, XML for --markdown-file)")
+  parser.add_argument("--jobs", type=int, default=1, metavar="N",
+      help="Number of processes to render the formats (or releases for --versions) in parallel "
+        "(default: 1)")
   arguments = parser.parse_args()
 
   if arguments.xml_file is not None:
-    output = convertChangelogFromXmlToMarkdown(arguments.xml_file, arguments.version)
+    inputFormat = "xml"
   elif arguments.markdown_file is not None:
-    output = convertChangelogFromMarkdownToXml(arguments.markdown_file, arguments.version)
+    inputFormat = "markdown"
   else:
     raise argparse.ArgumentError(xmlFileArgument,
         "One of --xml-file or --markdown-file is required")
 
-  if str(arguments.output_file) == "-":
-    print(output, end="")
-  else:
-    with open(arguments.output_file, "w") as f: f.write(output)
+  outputs = []
+
+  for format_ in (arguments.format if arguments.format is not None else
+        ["markdown" if inputFormat == "xml" else "xml"]):
+    format_, _, outputFilePath = format_.partition("=")
+    if format_ not in changelogRenderers:
+      raise argparse.ArgumentError(formatArgument, f"Unknown format '{format_}'")
+    outputs.append((format_,
+        pathlib.Path(outputFilePath) if outputFilePath != "" else arguments.output_file))
+
+  if arguments.versions is not None:
+    if arguments.output_dir is None:
+      raise argparse.ArgumentError(versionsArgument, "--output-dir is required for --versions")
+
+    changelog = (parseChangelogFromXml(arguments.xml_file) if inputFormat == "xml" else
+        parseChangelogFromMarkdown(arguments.markdown_file))
+
+    try:
+      releases = selectReleases(changelog, arguments.versions)
+    except ValueError as e:
+      raise argparse.ArgumentError(versionsArgument, str(e))
+
+    exportReleases(releases, [x for x, _ in outputs], arguments.output_dir, arguments.jobs)
+    print(f"Exported {len(releases)} release(s) to '{arguments.output_dir}'.")
+    return
+
+  if (inputFormat == "xml") and (len(outputs) == 1) and (outputs[0][0] == "markdown"):
+    # the per-release index makes this the fastest path for the commonest conversion
+    writeOutputFile(outputs[0][1],
+        convertChangelogFromXmlToMarkdown(arguments.xml_file, arguments.version))
+    return
+
+  changelog = (parseChangelogFromXml(arguments.xml_file, arguments.version)
+      if inputFormat == "xml" else
+      parseChangelogFromMarkdown(arguments.markdown_file, arguments.version))
+  renderedOutputs = renderChangelogInFormats(changelog, [x for x, _ in outputs],
+      arguments.version, arguments.jobs)
+  for (_, outputFilePath), output in zip(outputs, renderedOutputs):
+    writeOutputFile(outputFilePath, output)
 
 
 
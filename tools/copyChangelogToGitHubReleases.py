@@ -6,12 +6,15 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import argparse
+import concurrent.futures
 import json
 import pathlib
 import sys
-from typing import cast, List
+import threading
+import time
+from typing import Any, Dict, List
 import urllib.parse
-import xml.etree.ElementTree as et
 
 import semver
 
@@ -21,21 +24,17 @@ import convertChangelog
 
 
 
-def getVersions(changelogFilePath: pathlib.Path) -> List[str]:
-  document = et.parse(changelogFilePath).getroot()
-  releases = document.findall("./{http://maven.apache.org/changes/1.0.0}body"
-      "/{http://maven.apache.org/changes/1.0.0}release")
-  return [x.attrib["version"] for x in releases if (x.attrib["date"] != "upcoming") and
-      (semver.VersionInfo.parse(x.attrib["version"]).major >= 4)]
+def getVersions(releases: List[Dict[str, Any]]) -> List[str]:
+  return [x["version"] for x in releases if (x["date"] != "upcoming") and
+      (semver.VersionInfo.parse(x["version"]).major >= 4)]
 
 
 
-def getReleaseIdOfGitHubRelease(version: str) -> int:
+def getGitHubReleases() -> Dict[str, Any]:
   apiUrl = (f"https://api.github.com/repos/{urllib.parse.quote_plus(common.organization)}/"
-      f"{urllib.parse.quote_plus(common.repository)}/releases/tags/"
-      f"{urllib.parse.quote_plus(version)}")
-  response = common.requestFromGitHub(apiUrl)
-  return cast(int, response["id"])
+      f"{urllib.parse.quote_plus(common.repository)}/releases?per_page=100")
+  return {x["tag_name"] : x for releases in common.requestPagesFromGitHub(apiUrl)
+      for x in releases}
 
 
 
@@ -46,16 +45,60 @@ def updateDescriptionOfGitHubRelease(releaseId: int, description: str) -> None:
 
 
 
+def updateDescriptionsOfGitHubReleases(descriptions: Dict[int, str], numberOfJobs: int,
+      minInterval: float) -> None:
+  lock = threading.Lock()
+  nextRequestTime = time.monotonic()
+
+  def update(releaseId: int) -> None:
+    nonlocal nextRequestTime
+
+    # GitHub asks to space out mutating requests, so start them at least minInterval apart
+    with lock:
+      waitTime = nextRequestTime - time.monotonic()
+      nextRequestTime = max(nextRequestTime, time.monotonic()) + minInterval
+
+    if waitTime > 0: time.sleep(waitTime)
+    updateDescriptionOfGitHubRelease(releaseId, descriptions[releaseId])
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfJobs) as executor:
+    list(executor.map(update, descriptions))
+
+
+
 def main() -> None:
+  parser = argparse.ArgumentParser(
+      description="Copy release notes from changelog.xml to the GitHub releases")
+  parser.add_argument("--jobs", type=int, default=4, metavar="N",
+      help="Number of releases to update in parallel (default: 4)")
+  parser.add_argument("--min-interval", type=float, default=1.0, metavar="SECONDS",
+      help="Minimum time between starting two updates (default: 1.0)")
+  args = parser.parse_args()
+
   changelogFilePath = pathlib.Path(pathlib.Path(__file__).parent.parent.joinpath("changelog.xml"))
-  versions = getVersions(changelogFilePath)
+  releases = convertChangelog.getChangelogIndex(changelogFilePath)["releases"]
+  versions = getVersions(releases)
+  descriptions = {x["version"] : x["markdown"] for x in releases}
+
+  print("Retrieving GitHub releases...")
+  gitHubReleases = getGitHubReleases()
+  missingVersions = [x for x in versions if x not in gitHubReleases]
+  assert len(missingVersions) == 0, "No GitHub releases found for versions {}".format(
+      ", ".join(f"'{x}'" for x in missingVersions))
+
+  changedDescriptions = {}
 
   for version in versions:
-    print(f"Processing version '{version}'...")
-    description = convertChangelog.convertChangelogFromXmlToMarkdown(changelogFilePath, version)
-    print(description)
-    releaseId = getReleaseIdOfGitHubRelease(version)
-    updateDescriptionOfGitHubRelease(releaseId, description)
+    gitHubRelease = gitHubReleases[version]
+    oldDescription = (gitHubRelease["body"] or "").replace("\r\n", "\n")
+
+    if oldDescription != descriptions[version]:
+      print(f"Description of version '{version}' has changed:")
+      print(descriptions[version])
+      changedDescriptions[gitHubRelease["id"]] = descriptions[version]
+
+  print(f"Updating {len(changedDescriptions)} of {len(versions)} GitHub releases...")
+  updateDescriptionsOfGitHubReleases(changedDescriptions, args.jobs, args.min_interval)
 
 
 
@@ -7,18 +7,25 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import argparse
+import concurrent.futures
+import hashlib
 import json
+import os
 import pathlib
 import platform
+import posixpath
 import re
 import shlex
+import shutil
+import stat
+import struct
 import subprocess
 import sys
 import tarfile
-from typing import Optional
-import urllib.error
-import urllib.parse
-import urllib.request
+import tempfile
+import time
+from typing import Any, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+import xml.sax.saxutils
 import zipfile
 
 import semver
@@ -28,14 +35,54 @@ import common
 
 
 
-libDirPath = common.repoDirPath.joinpath("lib")
-
-
+ltexLsCacheDirPath = common.cacheDirPath.joinpath("ltex-ls")
+contentTypesFileName = "[Content_Types].xml"
+# fixed instead of guessed from the MIME types of the host, so that packages are reproducible
+libContentTypes = {
+      ".bat" : "application/x-msdownload",
+      ".dll" : "application/x-msdownload",
+      ".exe" : "application/x-msdownload",
+      ".html" : "text/html",
+      ".jar" : "application/java-archive",
+      ".js" : "application/javascript",
+      ".json" : "application/json",
+      ".md" : "text/markdown",
+      ".sh" : "application/x-sh",
+      ".txt" : "text/plain",
+      ".xml" : "application/xml",
+    }
+zipLocalFileHeaderStruct = struct.Struct("<4s2B4HL2L2H")
+# range of Python versions whose zipfile internals copyZipMemberRaw has been checked against
+zipRawCopyPythonVersions = ((3, 8), (3, 13))
+zipRawCopyZipFileAttributes = ["_lock", "_writecheck", "_didModify", "start_dir"]
+stagingIgnorePatterns = [".cache", ".git", ".mypy_cache", ".vscode-test", "__pycache__",
+    "node_modules", "tmp-*", "*.vsix"]
+
+
+
+def createStagingDir(stagingDirPath: pathlib.Path) -> pathlib.Path:
+  print(f"Creating staging directory '{stagingDirPath}'...")
+  ignore = shutil.ignore_patterns(*stagingIgnorePatterns)
+  ignoredNames = ignore(str(common.repoDirPath), [x.name for x in common.repoDirPath.iterdir()])
+
+  for childPath in sorted(common.repoDirPath.iterdir()):
+    stagingChildPath = stagingDirPath.joinpath(childPath.name)
+
+    if childPath.name in [".git", "node_modules"]:
+      # only needed for running vscode:prepublish, both are not packaged
+      stagingChildPath.symlink_to(childPath, target_is_directory=True)
+    elif (childPath.name in ignoredNames) or (childPath.name == "lib"):
+      # lib/ is recreated below, but only the top-level one must be skipped
+      continue
+    elif childPath.is_dir():
+      shutil.copytree(childPath, stagingChildPath, symlinks=True, ignore=ignore)
+    else:
+      shutil.copy2(childPath, stagingChildPath)
 
-def cleanLibDir() -> None:
-  cmd = ["git", "-C", str(common.repoDirPath), "clean", "-f", "-x", str(libDirPath)]
-  print("Cleaning lib/ by running '{}'...".format(" ".join(shlex.quote(x) for x in cmd)))
-  subprocess.run(cmd)
+  libDirPath = stagingDirPath.joinpath("lib")
+  libDirPath.mkdir()
+  shutil.copy2(common.repoDirPath.joinpath("lib", ".keep"), libDirPath.joinpath(".keep"))
+  return libDirPath
 
 
 
@@ -45,24 +92,62 @@ def getLtexVersion() -> semver.VersionInfo:
 
 
 
-def downloadLtexLs(platform: str, arch: str) -> None:
+def getLtexLsArchive(platform: str, arch: str) -> pathlib.Path:
   ltexLsArchiveType = ("zip" if platform == "windows" else "tar.gz")
   ltexLsArchiveName = (
       f"ltex-ls-{common.toBeDownloadedLtexLsVersion}-{platform}-{arch}.{ltexLsArchiveType}")
+  hashDigest = common.toBeDownloadedLtexLsHashDigests[ltexLsArchiveName]
+  ltexLsArchivePath = ltexLsCacheDirPath.joinpath(f"{hashDigest}.{ltexLsArchiveType}")
+
+  if ltexLsArchivePath.is_file():
+    print(f"Using cached ltex-ls archive '{ltexLsArchivePath}' for '{ltexLsArchiveName}'...")
+    # mark as recently used for eviction
+    os.utime(ltexLsArchivePath)
+  else:
+    downloadLtexLs(ltexLsArchiveName, hashDigest, ltexLsArchivePath)
 
+  return ltexLsArchivePath
+
+def downloadLtexLs(ltexLsArchiveName: str, hashDigest: str,
+      ltexLsArchivePath: pathlib.Path) -> None:
   ltexLsUrl = ("https://github.com/valentjn/ltex-ls/releases/download/"
       f"{common.toBeDownloadedLtexLsTag}/{ltexLsArchiveName}")
-  ltexLsArchivePath = libDirPath.joinpath(ltexLsArchiveName)
   print(f"Downloading ltex-ls {common.toBeDownloadedLtexLsVersion} from '{ltexLsUrl}' to "
       f"'{ltexLsArchivePath}'...")
-  urllib.request.urlretrieve(ltexLsUrl, ltexLsArchivePath)
-
-  extractLtexLs(ltexLsArchivePath)
-
-  print("Removing ltex-ls archive...")
-  ltexLsArchivePath.unlink()
-
-def extractLtexLs(ltexLsArchivePath: pathlib.Path) -> None:
+  ltexLsArchivePath.parent.mkdir(parents=True, exist_ok=True)
+  fileDescriptor, tmpFilePathStr = tempfile.mkstemp(dir=ltexLsArchivePath.parent,
+      prefix=f".{ltexLsArchivePath.name}.")
+  hash_ = hashlib.sha256()
+
+  try:
+    with os.fdopen(fileDescriptor, "wb") as f:
+      for chunk in common.streamFromGitHub(ltexLsUrl):
+        hash_.update(chunk)
+        f.write(chunk)
+
+    if hash_.hexdigest() != hashDigest:
+      raise RuntimeError(f"Hash digest of '{ltexLsUrl}' is '{hash_.hexdigest()}', "
+          f"but expected '{hashDigest}'")
+
+    os.replace(tmpFilePathStr, ltexLsArchivePath)
+  except BaseException:
+    pathlib.Path(tmpFilePathStr).unlink(missing_ok=True)
+    raise
+
+def evictLtexLsCache(maxCacheSize: int) -> None:
+  if not ltexLsCacheDirPath.is_dir(): return
+  cacheSize = 0
+
+  for filePath in sorted((x for x in ltexLsCacheDirPath.iterdir()
+        if x.is_file() and not x.name.startswith(".")),
+        key=lambda x: x.stat().st_mtime, reverse=True):
+    cacheSize += filePath.stat().st_size
+
+    if cacheSize > maxCacheSize:
+      print(f"Evicting '{filePath}' from ltex-ls cache...")
+      filePath.unlink(missing_ok=True)
+
+def extractLtexLs(ltexLsArchivePath: pathlib.Path, libDirPath: pathlib.Path) -> None:
   print("Extracting ltex-ls archive...")
 
   if ltexLsArchivePath.suffix == ".zip":
@@ -72,7 +157,8 @@ def extractLtexLs(ltexLsArchivePath: pathlib.Path) -> None:
 
 
 
-def createPackage(ltexPlatform: Optional[str] = None, ltexArch: Optional[str] = None) -> None:
+def getPackagePath(ltexPlatform: Optional[str] = None,
+      ltexArch: Optional[str] = None) -> pathlib.Path:
   ltexVersion = getLtexVersion()
 
   if ltexPlatform is None:
@@ -81,9 +167,234 @@ def createPackage(ltexPlatform: Optional[str] = None, ltexArch: Optional[str] =
     packageName = f"vscode-ltex-{ltexVersion}-offline-{ltexPlatform}-{ltexArch}.vsix"
 
   assert re.match(r"^[\-\.0-9A-Z_a-z]+$", packageName) is not None
-  cmd = f"vsce package -o \"{packageName}\""
-  print(f"Creating package by running '{cmd}'...")
-  subprocess.run(cmd, shell=True)
+  return pathlib.Path(packageName).resolve()
+
+def createPackage(packageDirPath: pathlib.Path, packagePath: pathlib.Path) -> None:
+  # resolve vsce without a shell (on Windows, it's vsce.cmd)
+  vscePath = shutil.which("vsce")
+  assert vscePath is not None, "Could not find vsce"
+  cmd = [vscePath, "package", "-o", str(packagePath)]
+  print(f"Creating package by running '{shlex.join(cmd)}' in '{packageDirPath}'...")
+  subprocess.run(cmd, cwd=packageDirPath, check=True,
+      env={**os.environ, "LTEX_TOOLS_CACHE_DIR" : str(common.cacheDirPath)})
+
+
+
+def createBasePackage(basePackagePath: pathlib.Path) -> str:
+  # the base package lacks [Content_Types].xml, which is returned instead, as it has to be
+  # rewritten after the entries of ltex-ls have been appended
+  vscePackagePath = basePackagePath.with_name(f"vsce-{basePackagePath.name}")
+
+  with tempfile.TemporaryDirectory(prefix="vscode-ltex-base-") as stagingDirPathStr:
+    stagingDirPath = pathlib.Path(stagingDirPathStr)
+    createStagingDir(stagingDirPath)
+    createPackage(stagingDirPath, vscePackagePath)
+
+  try:
+    with zipfile.ZipFile(vscePackagePath, "r") as vscePackageZipFile, \
+          zipfile.ZipFile(basePackagePath, "w", zipfile.ZIP_DEFLATED) as basePackageZipFile:
+      for zipInfo in vscePackageZipFile.infolist():
+        if zipInfo.filename != contentTypesFileName:
+          copyZipMember(vscePackageZipFile, zipInfo, basePackageZipFile, zipInfo.filename)
+
+      return vscePackageZipFile.read(contentTypesFileName).decode()
+  finally:
+    vscePackagePath.unlink(missing_ok=True)
+
+def createPackageFromBasePackage(basePackagePath: pathlib.Path, contentTypesXml: str,
+      ltexLsArchivePath: pathlib.Path, packagePath: pathlib.Path) -> None:
+  print(f"Creating '{packagePath}' from base package and ltex-ls archive...")
+  tmpPackagePath = packagePath.with_name(f".{packagePath.name}.tmp")
+
+  try:
+    # the entries of the base package are kept as they are, only new entries are appended
+    shutil.copyfile(basePackagePath, tmpPackagePath)
+
+    with zipfile.ZipFile(tmpPackagePath, "a", zipfile.ZIP_DEFLATED) as packageZipFile:
+      libFileNames = writeLtexLsArchiveToPackage(ltexLsArchivePath, packageZipFile)
+      packageZipFile.writestr(contentTypesFileName,
+          addContentTypes(contentTypesXml, libFileNames).encode())
+
+    os.replace(tmpPackagePath, packagePath)
+  except BaseException:
+    tmpPackagePath.unlink(missing_ok=True)
+    raise
+
+def writeLtexLsArchiveToPackage(ltexLsArchivePath: pathlib.Path,
+      packageZipFile: zipfile.ZipFile) -> List[str]:
+  fileNames = []
+
+  if ltexLsArchivePath.suffix == ".zip":
+    with zipfile.ZipFile(ltexLsArchivePath, "r") as zipFile:
+      for zipInfo in zipFile.infolist():
+        if zipInfo.is_dir(): continue
+        fileName = getPackageLibFileName(zipInfo.filename)
+        copyZipMember(zipFile, zipInfo, packageZipFile, fileName)
+        fileNames.append(fileName)
+  else:
+    with tarfile.open(ltexLsArchivePath, "r:gz") as tarFile:
+      for tarInfo in tarFile.getmembers():
+        # links are resolved like vsce does when packaging lib/
+        for memberName, sourceTarInfo in getTarMemberFiles(tarFile, tarInfo):
+          sourceFile = tarFile.extractfile(sourceTarInfo)
+          assert sourceFile is not None, sourceTarInfo.name
+          fileName = getPackageLibFileName(memberName)
+          # ZIP doesn't support timestamps before 1980 (in local time)
+          zipInfo = zipfile.ZipInfo(fileName,
+              date_time=max(time.localtime(tarInfo.mtime)[:6], (1980, 1, 1, 0, 0, 0)))
+          zipInfo.compress_type = zipfile.ZIP_DEFLATED
+          # Unix, as otherwise the mode bits in external_attr are ignored
+          zipInfo.create_system = 3
+          zipInfo.external_attr = (stat.S_IFREG | (sourceTarInfo.mode & 0o777)) << 16
+
+          with sourceFile, packageZipFile.open(zipInfo, "w") as targetFile:
+            shutil.copyfileobj(sourceFile, targetFile, 1 << 20)
+
+          fileNames.append(fileName)
+
+  return fileNames
+
+def getTarMemberFiles(tarFile: tarfile.TarFile, tarInfo: tarfile.TarInfo,
+      visitedDirNames: FrozenSet[str] = frozenset()) -> Iterator[Tuple[str, tarfile.TarInfo]]:
+  # yield the names of the regular files that the member stands for, together with the members
+  # containing their contents; links to directories are expanded
+  targetTarInfo = resolveTarLink(tarFile, tarInfo)
+
+  if targetTarInfo is None:
+    return
+  elif targetTarInfo.isfile():
+    yield tarInfo.name, targetTarInfo
+  elif (tarInfo is not targetTarInfo) and targetTarInfo.isdir() \
+        and (targetTarInfo.name not in visitedDirNames):
+    visitedDirNames = visitedDirNames | {targetTarInfo.name}
+    prefix = f"{targetTarInfo.name}/"
+
+    for childTarInfo in tarFile.getmembers():
+      if not childTarInfo.name.startswith(prefix): continue
+
+      for memberName, sourceTarInfo in getTarMemberFiles(tarFile, childTarInfo, visitedDirNames):
+        yield posixpath.join(tarInfo.name, memberName[len(prefix):]), sourceTarInfo
+
+def resolveTarLink(tarFile: tarfile.TarFile,
+      tarInfo: tarfile.TarInfo) -> Optional[tarfile.TarInfo]:
+  for _ in range(32):
+    if tarInfo.issym():
+      linkTargetName = posixpath.normpath(
+          posixpath.join(posixpath.dirname(tarInfo.name), tarInfo.linkname))
+    elif tarInfo.islnk():
+      linkTargetName = tarInfo.linkname
+    else:
+      return tarInfo
+
+    try:
+      tarInfo = tarFile.getmember(linkTargetName)
+    except KeyError:
+      # dangling link
+      return None
+
+  # too many levels of links
+  return None
+
+def getPackageLibFileName(archiveMemberName: str) -> str:
+  archiveMemberName = posixpath.normpath(archiveMemberName.replace("\\", "/"))
+  assert not (archiveMemberName.startswith("/") or archiveMemberName.startswith("../")), \
+      f"Unsafe archive member name '{archiveMemberName}'"
+  return f"extension/lib/{archiveMemberName}"
+
+def copyZipMember(sourceZipFile: zipfile.ZipFile, sourceZipInfo: zipfile.ZipInfo,
+      targetZipFile: zipfile.ZipFile, targetFileName: str) -> None:
+  targetZipInfo = zipfile.ZipInfo(targetFileName, date_time=sourceZipInfo.date_time)
+  targetZipInfo.compress_type = sourceZipInfo.compress_type
+  targetZipInfo.create_system = sourceZipInfo.create_system
+  targetZipInfo.external_attr = sourceZipInfo.external_attr
+
+  if canCopyZipMemberRaw(sourceZipInfo, targetZipFile):
+    copyZipMemberRaw(sourceZipFile, sourceZipInfo, targetZipFile, targetZipInfo)
+    return
+
+  # fall back to recompressing the member
+  with sourceZipFile.open(sourceZipInfo, "r") as sourceFile, \
+        targetZipFile.open(targetZipInfo, "w") as targetFile:
+    shutil.copyfileobj(sourceFile, targetFile, 1 << 20)
+
+def canCopyZipMemberRaw(sourceZipInfo: zipfile.ZipInfo, targetZipFile: zipfile.ZipFile) -> bool:
+  # zipfile has no public API for writing compressed data, so the raw copy relies on internals
+  # of ZipFile, which are only used with the Python versions that they have been checked with
+  return ((zipRawCopyPythonVersions[0] <= sys.version_info[:2] <= zipRawCopyPythonVersions[1])
+      and all(hasattr(targetZipFile, x) for x in zipRawCopyZipFileAttributes)
+      and (sourceZipInfo.compress_type in [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+      and ((sourceZipInfo.flag_bits & 0x1) == 0))
+
+def copyZipMemberRaw(sourceZipFile: zipfile.ZipFile, sourceZipInfo: zipfile.ZipInfo,
+      targetZipFile: zipfile.ZipFile, targetZipInfo: zipfile.ZipInfo) -> None:
+  # mirrors what ZipFile.open(..., "w") does, but with the compressed data of the source member
+  assert (sourceZipFile.fp is not None) and (targetZipFile.fp is not None)
+  sourceZipFile.fp.seek(sourceZipInfo.header_offset)
+  localFileHeader = zipLocalFileHeaderStruct.unpack(
+      sourceZipFile.fp.read(zipLocalFileHeaderStruct.size))
+  assert localFileHeader[0] == b"PK\x03\x04", f"Bad local header of '{sourceZipInfo.filename}'"
+  # skip file name and extra field
+  sourceZipFile.fp.seek(localFileHeader[10] + localFileHeader[11], os.SEEK_CUR)
+
+  targetZipInfo.CRC = sourceZipInfo.CRC
+  targetZipInfo.compress_size = sourceZipInfo.compress_size
+  targetZipInfo.file_size = sourceZipInfo.file_size
+  zipFileInternals: Any = targetZipFile
+
+  with zipFileInternals._lock:
+    zipFileInternals._writecheck(targetZipInfo)
+    targetZipFile.fp.seek(zipFileInternals.start_dir)
+    targetZipInfo.header_offset = targetZipFile.fp.tell()
+    zipFileInternals._didModify = True
+    targetZipFile.fp.write(targetZipInfo.FileHeader())
+    remainingSize = targetZipInfo.compress_size
+
+    while remainingSize > 0:
+      chunk = sourceZipFile.fp.read(min(remainingSize, 1 << 20))
+      assert len(chunk) > 0, f"Unexpected end of '{sourceZipInfo.filename}'"
+      targetZipFile.fp.write(chunk)
+      remainingSize -= len(chunk)
+
+    zipFileInternals.start_dir = targetZipFile.fp.tell()
+    targetZipFile.filelist.append(targetZipInfo)
+    targetZipFile.NameToInfo[targetZipInfo.filename] = targetZipInfo
+
+def addContentTypes(contentTypesXml: str, fileNames: Iterable[str]) -> str:
+  extensions = set(x.lower() for x in re.findall(r"<Default Extension=\"(.*?)\"", contentTypesXml))
+  newDefaults = []
+
+  for fileName in fileNames:
+    extension = posixpath.splitext(fileName)[1].lower()
+    if (extension == "") or (extension in extensions): continue
+    extensions.add(extension)
+    contentType = libContentTypes.get(extension, "application/octet-stream")
+    newDefaults.append(f"<Default Extension=\"{xml.sax.saxutils.escape(extension)}\" "
+        f"ContentType=\"{contentType}\"/>")
+
+  return contentTypesXml.replace("</Types>", "".join(newDefaults) + "</Types>")
+
+
+
+def createOfflinePackage(ltexPlatform: str, ltexArch: str,
+      ltexLsArchivePath: Optional[pathlib.Path] = None,
+      basePackagePath: Optional[pathlib.Path] = None,
+      baseContentTypesXml: Optional[str] = None) -> pathlib.Path:
+  print(f"Processing platform '{ltexPlatform}' and architecture '{ltexArch}'...")
+  packagePath = getPackagePath(ltexPlatform, ltexArch)
+  if ltexLsArchivePath is None: ltexLsArchivePath = getLtexLsArchive(ltexPlatform, ltexArch)
+
+  if (basePackagePath is not None) and (baseContentTypesXml is not None):
+    createPackageFromBasePackage(basePackagePath, baseContentTypesXml, ltexLsArchivePath,
+        packagePath)
+  else:
+    with tempfile.TemporaryDirectory(
+          prefix=f"vscode-ltex-offline-{ltexPlatform}-{ltexArch}-") as stagingDirPathStr:
+      stagingDirPath = pathlib.Path(stagingDirPathStr)
+      libDirPath = createStagingDir(stagingDirPath)
+      extractLtexLs(ltexLsArchivePath, libDirPath)
+      createPackage(stagingDirPath, packagePath)
+
+  return packagePath
 
 
 
@@ -93,6 +404,13 @@ def main() -> None:
       help="Build offline package only for current platform/architecture")
   parser.add_argument("--ltex-ls-path", type=pathlib.Path, metavar="PATH",
       help="Don't download ltex-ls from GitHub, but use archive from this path")
+  parser.add_argument("--jobs", type=int, metavar="N",
+      help="Number of packages to build in parallel (default: all at once)")
+  parser.add_argument("--extract", action="store_true",
+      help="Extract ltex-ls to lib/ and run vsce for every package instead of appending the "
+        "ltex-ls archive to a shared base package")
+  parser.add_argument("--max-cache-size", type=int, default=1024, metavar="MIB",
+      help="Maximum size of the cache of downloaded ltex-ls archives in MiB (default: 1024)")
   args = parser.parse_args()
 
   if args.current_system:
@@ -109,20 +427,27 @@ def main() -> None:
   else:
     ltexPlatformArchs = [("linux", "x64"), ("mac", "x64"), ("windows", "x64")]
 
-  ltexLsArchivePath = args.ltex_ls_path
-  cleanLibDir()
+  ltexLsArchivePath = (args.ltex_ls_path.resolve() if args.ltex_ls_path is not None else None)
 
-  for ltexPlatform, ltexArch in ltexPlatformArchs:
-    print("")
-    print(f"Processing platform '{ltexPlatform}' and architecture '{ltexArch}'...")
+  with tempfile.TemporaryDirectory(prefix="vscode-ltex-") as tmpDirPathStr:
+    basePackagePath: Optional[pathlib.Path] = None
+    baseContentTypesXml: Optional[str] = None
 
-    if ltexLsArchivePath is None:
-      downloadLtexLs(ltexPlatform, ltexArch)
-    else:
-      extractLtexLs(ltexLsArchivePath)
+    if not args.extract:
+      print("Creating base package without ltex-ls...")
+      basePackagePath = pathlib.Path(tmpDirPathStr, "base.vsix")
+      baseContentTypesXml = createBasePackage(basePackagePath)
+
+    with concurrent.futures.ProcessPoolExecutor(
+          max_workers=(args.jobs if args.jobs is not None else len(ltexPlatformArchs))) as executor:
+      futures = [executor.submit(createOfflinePackage, ltexPlatform, ltexArch, ltexLsArchivePath,
+          basePackagePath, baseContentTypesXml) for ltexPlatform, ltexArch in ltexPlatformArchs]
+      packagePaths = [x.result() for x in futures]
+
+  evictLtexLsCache(args.max_cache_size * 1024 * 1024)
 
-    createPackage(ltexPlatform, ltexArch)
-    cleanLibDir()
+  print("")
+  for packagePath in packagePaths: print(f"Created '{packagePath}'.")
 
 
 
@@ -12,10 +12,10 @@ import random
 import re
 import sys
 from typing import List
-import xml.etree.ElementTree as et
 
 sys.path.append(str(pathlib.Path(__file__).parent))
 import common
+import convertChangelog
 
 
 
@@ -164,14 +164,11 @@ Vortex
 
 def getUsedSuffixes() -> List[str]:
   xmlFilePath = pathlib.Path(common.repoDirPath.joinpath("changelog.xml"))
-  document = et.parse(xmlFilePath).getroot()
-  releases = document.findall("./{http://maven.apache.org/changes/1.0.0}body"
-      "/{http://maven.apache.org/changes/1.0.0}release")
   usedSuffixes = []
 
-  for release in releases:
-    if ("description" not in release.attrib) or (release.attrib["date"] == "upcoming"): continue
-    regexMatch = re.search(r"The .* ([A-Za-z]+)", release.attrib["description"])
+  for release in convertChangelog.ChangelogReader(xmlFilePath).iterReleases():
+    if (len(release.description) == 0) or release.isUpcoming: continue
+    regexMatch = re.search(r"The .* ([A-Za-z]+)", release.description)
     assert regexMatch is not None
     usedSuffixes.append(regexMatch.group(1))
 
@@ -7,7 +7,10 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import argparse
+import concurrent.futures
 import glob
+import hashlib
+import itertools
 import json
 import os
 import pathlib
@@ -15,7 +18,7 @@ import re
 import shlex
 import subprocess
 import sys
-from typing import Any, Dict, Sequence, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, cast
 
 sys.path.append(str(pathlib.Path(__file__).parent))
 import common
@@ -23,6 +26,53 @@ import common
 
 
 toolsDirPath = common.repoDirPath.joinpath("tools")
+languageListerCacheDirPath = common.cacheDirPath.joinpath("languageToolLanguageLister")
+languageListCacheFilePath = languageListerCacheDirPath.joinpath("outputs.json")
+
+# setting name -> (key suffix of the description after which the language-specific entries are
+# generated, extra enum value or None if the entries are descriptions, name of the template)
+languageSpecificNlsSettings: Dict[str, Tuple[str, Optional[str], str]] = {
+      "ltex.language" : ("fullMarkdownDescription", "auto", "autoLanguageName"),
+      "ltex.dictionary" : ("fullMarkdownDescription", None, "dictionaryDescription"),
+      "ltex.disabledRules" : ("fullMarkdownDescription", None, "disabledRulesDescription"),
+      "ltex.enabledRules" : ("fullMarkdownDescription", None, "enabledRulesDescription"),
+      "ltex.hiddenFalsePositives" : ("fullMarkdownDescription", None,
+        "hiddenFalsePositivesDescription"),
+      "ltex.additionalRules.motherTongue" : ("markdownDescription", "emptyString",
+        "noMotherTongueName"),
+    }
+languageSpecificNlsKeyRegex = re.compile(r"ltex\.i18n\.configuration\.({})\.(.+)".format(
+    "|".join(re.escape(x) for x in languageSpecificNlsSettings)))
+
+# templates per UI language; {code} and {name} are replaced with the LanguageTool language
+packageNlsTemplates: Dict[str, Dict[str, str]] = {
+      "en" : {
+        "autoLanguageName" : "Automatic language detection (not recommended)",
+        "noMotherTongueName" : "No mother tongue",
+        "dictionaryDescription" : "List of additional `{code}` ({name}) words that should not be "
+          "counted as spelling errors.",
+        "disabledRulesDescription" : "List of additional `{code}` ({name}) rules that should be "
+          "disabled (if enabled by default by LanguageTool).",
+        "enabledRulesDescription" : "List of additional `{code}` ({name}) rules that should be "
+          "enabled (if disabled by default by LanguageTool).",
+        "hiddenFalsePositivesDescription" : "List of `{code}` ({name}) false-positive "
+          "diagnostics to hide.",
+      },
+      "de" : {
+        "autoLanguageName" : "Automatische Spracherkennung (nicht empfohlen)",
+        "noMotherTongueName" : "Keine Muttersprache",
+        "dictionaryDescription" : "Liste von zusätzlichen Wörtern der Sprache `{code}` ({name}), "
+          "die nicht als Schreibfehler gewertet werden sollen.",
+        "disabledRulesDescription" : "Liste von zusätzlichen Regeln der Sprache `{code}` "
+          "({name}), die deaktiviert werden sollen (falls standardmäßig durch LanguageTool "
+          "aktiviert).",
+        "enabledRulesDescription" : "Liste von zusätzlichen Regeln der Sprache `{code}` "
+          "({name}), die aktiviert werden sollen (falls standardmäßig durch LanguageTool "
+          "deaktiviert).",
+        "hiddenFalsePositivesDescription" : "Liste von falschen Fehlern der Sprache `{code}` "
+          "({name}), die verborgen werden sollen.",
+      },
+    }
 
 
 
@@ -30,12 +80,9 @@ def run(cmd: Sequence[str], **kwargs: Any) -> subprocess.CompletedProcess[bytes]
   print("Running {}...".format(" ".join(shlex.quote(x) for x in cmd)))
   return subprocess.run(cmd, stdout=subprocess.PIPE, cwd=toolsDirPath)
 
-def fetchLanguages(toolsDirPath: pathlib.Path,
-      ltexLsPath: pathlib.Path) -> Tuple[Sequence[str], Sequence[str]]:
-  classPath = os.pathsep.join([str(toolsDirPath), str(ltexLsPath.joinpath("lib", "*"))])
-  run(["javac", "-cp", classPath, "LanguageToolLanguageLister.java"])
-  process = run(["java", "-cp", classPath, "LanguageToolLanguageLister"])
-  stdout = process.stdout.decode()
+def fetchLanguages(toolsDirPath: pathlib.Path, ltexLsPath: Optional[pathlib.Path],
+      fromCache: bool = False) -> Tuple[Sequence[str], Sequence[str]]:
+  stdout = getLanguageListerOutput(toolsDirPath, ltexLsPath, fromCache)
   languages = sorted([dict(zip(("languageShortCode", "languageName"), line.split(";")))
       for line in stdout.splitlines()], key=lambda x: x["languageShortCode"])
   ltLanguageShortCodes = [x["languageShortCode"] for x in languages]
@@ -44,7 +91,60 @@ def fetchLanguages(toolsDirPath: pathlib.Path,
 
 
 
-def updatePackageJson(ltLanguageShortCodes: Sequence[str]) -> None:
+def getLanguageListerOutput(toolsDirPath: pathlib.Path, ltexLsPath: Optional[pathlib.Path],
+      fromCache: bool) -> str:
+  # the compiled lister and its output are cached per jar set of ltex-ls (and source of the
+  # lister), so that reruns do not start any JVM; with fromCache, no JDK is needed at all
+  try:
+    with open(languageListCacheFilePath, "r") as f: cache = json.load(f)
+  except (OSError, ValueError):
+    cache = {"latest" : None, "outputs" : {}}
+
+  key = (getLanguageListerCacheKey(toolsDirPath, ltexLsPath) if ltexLsPath is not None else None)
+
+  if key in cache["outputs"]:
+    print("Using cached output of LanguageToolLanguageLister...")
+    return cast(str, cache["outputs"][key])
+  elif fromCache:
+    assert cache["latest"] is not None, "No cached output of LanguageToolLanguageLister"
+    print("No cached output for this ltex-ls, using last cached output of "
+        "LanguageToolLanguageLister...")
+    return cast(str, cache["outputs"][cache["latest"]])
+
+  assert (ltexLsPath is not None) and (key is not None)
+  classDirPath = languageListerCacheDirPath.joinpath(key)
+  classPath = os.pathsep.join([str(classDirPath), str(ltexLsPath.joinpath("lib", "*"))])
+
+  if not classDirPath.joinpath("LanguageToolLanguageLister.class").is_file():
+    classDirPath.mkdir(parents=True, exist_ok=True)
+    run(["javac", "-d", str(classDirPath), "-cp", classPath, "LanguageToolLanguageLister.java"])
+
+  process = run(["java", "-cp", classPath, "LanguageToolLanguageLister"])
+  stdout = process.stdout.decode()
+
+  if (process.returncode == 0) and (len(stdout) > 0):
+    cache["outputs"][key] = stdout
+    cache["latest"] = key
+    common.writeFileAtomically(languageListCacheFilePath, json.dumps(cache, indent=2).encode())
+
+  return stdout
+
+
+
+def getLanguageListerCacheKey(toolsDirPath: pathlib.Path, ltexLsPath: pathlib.Path) -> str:
+  # jars are identified by name, size, and mtime, which is much cheaper than hashing them
+  with open(toolsDirPath.joinpath("LanguageToolLanguageLister.java"), "rb") as f:
+    hash_ = hashlib.sha256(f.read())
+
+  for jarFilePath in sorted(ltexLsPath.joinpath("lib").glob("*.jar")):
+    jarFileStat = jarFilePath.stat()
+    hash_.update(f"\n{jarFilePath.name};{jarFileStat.st_size};{jarFileStat.st_mtime_ns}".encode())
+
+  return hash_.hexdigest()
+
+
+
+def updatePackageJson(ltLanguageShortCodes: Sequence[str]) -> Dict[str, Any]:
   packageJsonPath = common.repoDirPath.joinpath("package.json")
   with open(packageJsonPath, "r") as f: packageJson = json.load(f)
   settings = packageJson["contributes"]["configuration"]["properties"]
@@ -89,134 +189,100 @@ def updatePackageJson(ltLanguageShortCodes: Sequence[str]) -> None:
     json.dump(packageJson, f, indent=2, ensure_ascii=False)
     f.write("\n")
 
+  return cast(Dict[str, Any], packageJson)
 
 
-def updatePackageNlsJson(ltLanguageShortCodes: Sequence[str], ltLanguageNames: Sequence[str],
-      uiLanguage: str) -> None:
-  packageNlsJsonPath = common.repoDirPath.joinpath("package.nls.json" if uiLanguage == "en" else
-      f"package.nls.{uiLanguage}.json")
-  with open(packageNlsJsonPath, "r") as f: oldPackageNlsJson = json.load(f)
 
-  newPackageNlsJson = {}
+def getPackageNlsTemplates(uiLanguage: str) -> Dict[str, str]:
+  # missing templates of a UI language fall back to English, see printUntranslatedNlsTemplates
+  return {**packageNlsTemplates["en"], **packageNlsTemplates.get(uiLanguage, {})}
 
-  for key, value in oldPackageNlsJson.items():
-    if key == "ltex.i18n.configuration.ltex.language.fullMarkdownDescription":
-      newPackageNlsJson[key] = value
-      curLtLanguageShortCodes = ["auto"] + ltLanguageShortCodes
-      curLtLanguageNames = [{
-            "en" : "Automatic language detection (not recommended)",
-            "de" : "Automatische Spracherkennung (nicht empfohlen)",
-          }[uiLanguage]] + ltLanguageNames
-
-      for ltLanguageShortCode, ltLanguageName in zip(curLtLanguageShortCodes, curLtLanguageNames):
-        prefix = f"ltex.i18n.configuration.ltex.language.{ltLanguageShortCode}"
-        newPackageNlsJson[f"{prefix}.markdownEnumDescription"] = ltLanguageName
-        newPackageNlsJson[f"{prefix}.enumDescription"] = ltLanguageName
-
-    elif re.match(r"^ltex\.i18n\.configuration\.ltex\.language\..+\.", key) is not None:
-      continue
 
-    elif key == "ltex.i18n.configuration.ltex.dictionary.fullMarkdownDescription":
-      newPackageNlsJson[key] = value
 
-      for ltLanguageShortCode, ltLanguageName in zip(ltLanguageShortCodes, ltLanguageNames):
-        prefix = f"ltex.i18n.configuration.ltex.dictionary.{ltLanguageShortCode}"
+def generateLanguageSpecificNlsEntries(settingName: str, ltLanguageShortCodes: Sequence[str],
+      ltLanguageNames: Sequence[str], templates: Dict[str, str]) -> Dict[str, str]:
+  entries = {}
+  prefix = f"ltex.i18n.configuration.{settingName}"
+  _, extraEnumValue, templateName = languageSpecificNlsSettings[settingName]
 
-        if uiLanguage == "de":
-          newPackageNlsJson[f"{prefix}.markdownDescription"] = (
-              "Liste von zusätzlichen Wörtern der Sprache "
-              f"`{ltLanguageShortCode}` ({ltLanguageName}), die nicht als Schreibfehler "
-              "gewertet werden sollen.")
-        else:
-          newPackageNlsJson[f"{prefix}.markdownDescription"] = (
-              f"List of additional `{ltLanguageShortCode}` ({ltLanguageName}) words that should "
-              "not be counted as spelling errors.")
+  if extraEnumValue is not None:
+    # enum descriptions, which are just the names of the languages
+    for ltLanguageShortCode, ltLanguageName in zip(
+          [extraEnumValue] + list(ltLanguageShortCodes),
+          [templates[templateName]] + list(ltLanguageNames)):
+      entries[f"{prefix}.{ltLanguageShortCode}.markdownEnumDescription"] = ltLanguageName
+      entries[f"{prefix}.{ltLanguageShortCode}.enumDescription"] = ltLanguageName
+  else:
+    template = templates[templateName]
 
-    elif re.match(r"^ltex\.i18n\.configuration\.ltex\.dictionary\..+\.", key) is not None:
-      continue
+    for ltLanguageShortCode, ltLanguageName in zip(ltLanguageShortCodes, ltLanguageNames):
+      entries[f"{prefix}.{ltLanguageShortCode}.markdownDescription"] = template.format(
+          code=ltLanguageShortCode, name=ltLanguageName)
 
-    elif key == "ltex.i18n.configuration.ltex.disabledRules.fullMarkdownDescription":
-      newPackageNlsJson[key] = value
-
-      for ltLanguageShortCode, ltLanguageName in zip(ltLanguageShortCodes, ltLanguageNames):
-        prefix = f"ltex.i18n.configuration.ltex.disabledRules.{ltLanguageShortCode}"
+  return entries
 
-        if uiLanguage == "de":
-          newPackageNlsJson[f"{prefix}.markdownDescription"] = (
-              "Liste von zusätzlichen Regeln der Sprache "
-              f"`{ltLanguageShortCode}` ({ltLanguageName}), die deaktiviert werden sollen "
-              "(falls standardmäßig durch LanguageTool aktiviert).")
-        else:
-          newPackageNlsJson[f"{prefix}.markdownDescription"] = (
-              f"List of additional `{ltLanguageShortCode}` ({ltLanguageName}) rules that should "
-              "be disabled (if enabled by default by LanguageTool).")
 
-    elif re.match(r"^ltex\.i18n\.configuration\.ltex\.disabledRules\..+\.", key) is not None:
-      continue
 
-    elif key == "ltex.i18n.configuration.ltex.enabledRules.fullMarkdownDescription":
-      newPackageNlsJson[key] = value
+def updatePackageNlsJson(ltLanguageShortCodes: Sequence[str], ltLanguageNames: Sequence[str],
+      uiLanguage: str) -> Dict[str, str]:
+  packageNlsJsonPath = common.repoDirPath.joinpath("package.nls.json" if uiLanguage == "en" else
+      f"package.nls.{uiLanguage}.json")
+  with open(packageNlsJsonPath, "r") as f: oldPackageNlsJson = json.load(f)
 
-      for ltLanguageShortCode, ltLanguageName in zip(ltLanguageShortCodes, ltLanguageNames):
-        prefix = f"ltex.i18n.configuration.ltex.enabledRules.{ltLanguageShortCode}"
+  templates = getPackageNlsTemplates(uiLanguage)
+  newPackageNlsJson = {}
 
-        if uiLanguage == "de":
-          newPackageNlsJson[f"{prefix}.markdownDescription"] = (
-              "Liste von zusätzlichen Regeln der Sprache "
-              f"`{ltLanguageShortCode}` ({ltLanguageName}), die aktiviert werden sollen "
-              "(falls standardmäßig durch LanguageTool deaktiviert).")
-        else:
-          newPackageNlsJson[f"{prefix}.markdownDescription"] = (
-              f"List of additional `{ltLanguageShortCode}` ({ltLanguageName}) rules that should "
-              "be enabled (if disabled by default by LanguageTool).")
+  for key, value in oldPackageNlsJson.items():
+    regexMatch = languageSpecificNlsKeyRegex.match(key)
 
-    elif re.match(r"^ltex\.i18n\.configuration\.ltex\.enabledRules\..+\.", key) is not None:
+    if regexMatch is None:
+      newPackageNlsJson[key] = value
       continue
 
-    elif key == "ltex.i18n.configuration.ltex.hiddenFalsePositives.fullMarkdownDescription":
+    settingName, suffix = regexMatch.group(1), regexMatch.group(2)
+
+    if suffix == languageSpecificNlsSettings[settingName][0]:
+      # the language-specific entries are generated right after the description of the setting
+      newPackageNlsJson[key] = value
+      newPackageNlsJson.update(generateLanguageSpecificNlsEntries(
+          settingName, ltLanguageShortCodes, ltLanguageNames, templates))
+    elif "." not in suffix:
       newPackageNlsJson[key] = value
 
-      for ltLanguageShortCode, ltLanguageName in zip(ltLanguageShortCodes, ltLanguageNames):
-        prefix = f"ltex.i18n.configuration.ltex.hiddenFalsePositives.{ltLanguageShortCode}"
+  with open(packageNlsJsonPath, "w") as f:
+    json.dump(newPackageNlsJson, f, indent=2, ensure_ascii=False)
+    f.write("\n")
+
+  return newPackageNlsJson
 
-        if uiLanguage == "de":
-          newPackageNlsJson[f"{prefix}.markdownDescription"] = (
-              "Liste von falschen Fehlern der Sprache "
-              f"`{ltLanguageShortCode}` ({ltLanguageName}), die verborgen werden sollen.")
-        else:
-          newPackageNlsJson[f"{prefix}.markdownDescription"] = (
-              f"List of `{ltLanguageShortCode}` ({ltLanguageName}) false-positive diagnostics to hide.")
 
-    elif re.match(r"^ltex\.i18n\.configuration\.ltex\.hiddenFalsePositives\..+\.", key) is not None:
-      continue
 
-    elif key == "ltex.i18n.configuration.ltex.additionalRules.motherTongue.markdownDescription":
-      newPackageNlsJson[key] = value
+def updatePackageNlsJsons(ltLanguageShortCodes: Sequence[str], ltLanguageNames: Sequence[str],
+      uiLanguages: Sequence[str], numberOfJobs: int) -> List[Dict[str, str]]:
+  if (numberOfJobs <= 1) or (len(uiLanguages) <= 1):
+    return [updatePackageNlsJson(ltLanguageShortCodes, ltLanguageNames, x) for x in uiLanguages]
 
-      prefix = f"ltex.i18n.configuration.ltex.additionalRules.motherTongue.emptyString"
+  with concurrent.futures.ProcessPoolExecutor(min(numberOfJobs, len(uiLanguages))) as executor:
+    return list(executor.map(updatePackageNlsJson, itertools.repeat(ltLanguageShortCodes),
+        itertools.repeat(ltLanguageNames), uiLanguages))
 
-      if uiLanguage == "de":
-        newPackageNlsJson[f"{prefix}.markdownEnumDescription"] = "Keine Muttersprache"
-        newPackageNlsJson[f"{prefix}.enumDescription"] = "Keine Muttersprache"
-      else:
-        newPackageNlsJson[f"{prefix}.markdownEnumDescription"] = "No mother tongue"
-        newPackageNlsJson[f"{prefix}.enumDescription"] = "No mother tongue"
 
-      for ltLanguageShortCode, ltLanguageName in zip(ltLanguageShortCodes, ltLanguageNames):
-        prefix = f"ltex.i18n.configuration.ltex.additionalRules.motherTongue.{ltLanguageShortCode}"
-        newPackageNlsJson[f"{prefix}.markdownEnumDescription"] = ltLanguageName
-        newPackageNlsJson[f"{prefix}.enumDescription"] = ltLanguageName
 
-    elif re.match(r"^ltex\.i18n\.configuration\.ltex\.additionalRules.motherTongue\..+\.",
-          key) is not None:
-      continue
+def printUndefinedNlsKeys(fileName: str, usedNlsKeys: Set[str],
+      packageNlsJson: Dict[str, str]) -> None:
+  undefinedNlsKeys = sorted(usedNlsKeys - set(packageNlsJson))
+  if len(undefinedNlsKeys) == 0: return
+  print(f"Warning: NLS keys used in package.json, but undefined in {fileName}: "
+      + ", ".join(undefinedNlsKeys))
 
-    else:
-      newPackageNlsJson[key] = value
 
-  with open(packageNlsJsonPath, "w") as f:
-    json.dump(newPackageNlsJson, f, indent=2, ensure_ascii=False)
-    f.write("\n")
+
+def printUntranslatedNlsTemplates(fileName: str, uiLanguage: str) -> None:
+  untranslatedTemplateNames = sorted(set(packageNlsTemplates["en"])
+      - set(packageNlsTemplates.get(uiLanguage, {})))
+  if len(untranslatedTemplateNames) == 0: return
+  print(f"Warning: Templates untranslated for UI language '{uiLanguage}', writing English text "
+      f"to {fileName}: " + ", ".join(untranslatedTemplateNames))
 
 
 
@@ -227,31 +293,45 @@ def main() -> None:
       default=pathlib.Path(__file__).parent.parent.parent.joinpath(
         "ltex-ls", "target", "appassembler"),
       help="Path to ltex-ls relative from the root directory of LTeX, supports wildcards")
+  parser.add_argument("--jobs", type=int, default=4, metavar="N",
+      help="Number of package.nls files to generate in parallel (default: 4)")
+  parser.add_argument("--from-cache", action="store_true",
+      help="Do not run Java, but use the cached languages (of the last ltex-ls if ltex-ls is "
+        "not found or not cached)")
   args = parser.parse_args()
 
   ltexLsPaths = glob.glob(str(common.repoDirPath.joinpath(args.ltex_ls_path)))
-  assert len(ltexLsPaths) > 0, "ltex-ls not found"
+  assert args.from_cache or (len(ltexLsPaths) > 0), "ltex-ls not found"
   assert len(ltexLsPaths) < 2, "multiple ltex-ls found via wildcard"
-  ltexLsPath = pathlib.Path(ltexLsPaths[0])
-  print(f"Using ltex-ls from {ltexLsPath}")
+  ltexLsPath = (pathlib.Path(ltexLsPaths[0]) if len(ltexLsPaths) > 0 else None)
+  if ltexLsPath is not None: print(f"Using ltex-ls from {ltexLsPath}")
 
   print("Fetching languages from LanguageTool...")
-  ltLanguageShortCodes, ltLanguageNames = fetchLanguages(toolsDirPath, ltexLsPath)
+  ltLanguageShortCodes, ltLanguageNames = fetchLanguages(toolsDirPath, ltexLsPath,
+      args.from_cache)
   assert len(ltLanguageShortCodes) > 0, "No languages found."
   print("LanguageTool languages: {}".format(", ".join(ltLanguageShortCodes)))
 
   print("Updating package.json...")
-  updatePackageJson(ltLanguageShortCodes)
+  packageJson = updatePackageJson(ltLanguageShortCodes)
+  usedNlsKeys = common.getUsedNlsKeysFromPackageJson(packageJson)
 
-  print("Updating package.nls.json...")
-  updatePackageNlsJson(ltLanguageShortCodes, ltLanguageNames, "en")
+  uiLanguages = ["en"]
 
   for childPath in sorted(common.repoDirPath.iterdir()):
     match = re.match(r"^package\.nls\.([A-Za-z0-9\-_]+)\.json$", childPath.name)
-    if match is None: continue
-    uiLanguage = match.group(1)
-    print(f"Updating package.nls.{uiLanguage}.json...")
-    updatePackageNlsJson(ltLanguageShortCodes, ltLanguageNames, uiLanguage)
+    if match is not None: uiLanguages.append(match.group(1))
+
+  fileNames = [("package.nls.json" if x == "en" else f"package.nls.{x}.json") for x in uiLanguages]
+  for fileName, uiLanguage in zip(fileNames, uiLanguages):
+    printUntranslatedNlsTemplates(fileName, uiLanguage)
+
+  print("Updating {}...".format(", ".join(fileNames)))
+  packageNlsJsons = updatePackageNlsJsons(ltLanguageShortCodes, ltLanguageNames, uiLanguages,
+      args.jobs)
+
+  for fileName, packageNlsJson in zip(fileNames, packageNlsJsons):
+    printUndefinedNlsKeys(fileName, usedNlsKeys, packageNlsJson)
 
 
 
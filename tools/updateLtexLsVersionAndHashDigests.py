@@ -7,11 +7,14 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import argparse
+import concurrent.futures
 import hashlib
+import json
 import pathlib
 import re
 import sys
-from typing import Dict, Iterable
+from typing import Any, Dict, Iterable, Optional
+import urllib.error
 import urllib.parse
 
 import semver
@@ -22,7 +25,7 @@ import common
 
 
 def getLatestLtexLsVersion(versions: Iterable[str],
-      allowPrerelease: bool = False) -> semver.VersionInfo:
+      allowPrerelease: bool = False) -> Optional[semver.VersionInfo]:
   latestVersion = None
 
   for versionString in versions:
@@ -37,12 +40,63 @@ def getLatestLtexLsVersion(versions: Iterable[str],
 
 
 
-def getDownloadUrlsOfGitHubReleases(organizationName: str, repositoryName: str,
-      tagName: str) -> Dict[str, str]:
-  apiUrl = (f"https://api.github.com/repos/{urllib.parse.quote_plus(organizationName)}/"
-      f"{urllib.parse.quote_plus(repositoryName)}/releases/tags/{urllib.parse.quote_plus(tagName)}")
-  response = common.requestFromGitHub(apiUrl)
-  return {x["name"] : x["browser_download_url"] for x in response["assets"]}
+def getReleasesApiUrl(organizationName: str, repositoryName: str) -> str:
+  return (f"https://api.github.com/repos/{urllib.parse.quote_plus(organizationName)}/"
+      f"{urllib.parse.quote_plus(repositoryName)}/releases")
+
+
+
+def getLatestLtexLsRelease(organizationName: str, repositoryName: str,
+      allowPrerelease: bool = False) -> Any:
+  latestRelease = None
+  latestVersion = None
+
+  for releases in common.requestPagesFromGitHub(
+        f"{getReleasesApiUrl(organizationName, repositoryName)}?per_page=100"):
+    releasesByVersion = {x["tag_name"] : x for x in releases}
+    version = getLatestLtexLsVersion(releasesByVersion, allowPrerelease=allowPrerelease)
+
+    if (version is not None) and ((latestVersion is None) or (version > latestVersion)):
+      latestVersion = version
+      latestRelease = releasesByVersion[str(version)]
+    elif latestVersion is not None:
+      # GitHub lists releases from newest to oldest, so if a whole page doesn't contain a newer
+      # version, older pages won't either
+      break
+
+  assert latestRelease is not None, "No release with a valid semantic version found"
+  return latestRelease
+
+
+
+def getGitHubReleaseByTag(organizationName: str, repositoryName: str, tagName: str) -> Any:
+  releasesApiUrl = getReleasesApiUrl(organizationName, repositoryName)
+
+  try:
+    return json.loads(common.gitHubSession.request(
+        f"{releasesApiUrl}/tags/{urllib.parse.quote_plus(tagName)}",
+        headers=common.getGitHubHeaders()).body)
+  except urllib.error.HTTPError as e:
+    if e.code != 404: common.handleGitHubHttpError(e)
+
+  # releases/tags/{tag} doesn't return draft releases, so search the whole list
+  for releases in common.requestPagesFromGitHub(f"{releasesApiUrl}?per_page=100"):
+    for release in releases:
+      if release["tag_name"] == tagName: return release
+
+  raise RuntimeError(f"Could not find release with tag '{tagName}'")
+
+
+
+def getDownloadUrlsOfGitHubRelease(release: Any) -> Dict[str, str]:
+  return {x["name"] : x["browser_download_url"] for x in release["assets"]}
+
+
+
+def computeHashDigestOfDownload(url: str) -> str:
+  hash_ = hashlib.sha256()
+  for chunk in common.streamFromGitHub(url): hash_.update(chunk)
+  return hash_.hexdigest()
 
 
 
@@ -52,40 +106,37 @@ def main() -> None:
       help="Allow prerelease versions")
   parser.add_argument("--tag",
       help="Tag to use; if omitted, tag with latest semantic version will be used")
+  parser.add_argument("--jobs", type=int, default=4, metavar="N",
+      help="Number of assets to download in parallel (default: 4)")
   args = parser.parse_args()
 
-  print("Retrieving list of releases of LTeX LS...")
-  releases = common.requestFromGitHub("https://api.github.com/repos/valentjn/ltex-ls/releases")
-
   if args.tag is not None:
+    print(f"Retrieving release of LTeX LS with tag '{args.tag}'...")
+    release = getGitHubReleaseByTag("valentjn", "ltex-ls", args.tag)
     ltexLsTag = args.tag
-
-    for release in releases:
-      if release["tag_name"] == ltexLsTag:
-        ltexLsVersion = release["name"]
-        break
+    ltexLsVersion = release["name"]
   else:
-    ltexLsVersion = getLatestLtexLsVersion([x["tag_name"] for x in releases],
+    print("Retrieving latest release of LTeX LS...")
+    release = getLatestLtexLsRelease("valentjn", "ltex-ls",
         allowPrerelease=args.allow_prerelease)
-    ltexLsVersion = str(ltexLsVersion)
-    ltexLsTag = ltexLsVersion
+    ltexLsTag = release["tag_name"]
+    ltexLsVersion = ltexLsTag
 
-  print(f"Retrieving list of assets for LTeX LS {ltexLsVersion} (tag '{ltexLsTag}')...")
-  downloadUrls = getDownloadUrlsOfGitHubReleases("valentjn", "ltex-ls", ltexLsTag)
+  print(f"Using LTeX LS {ltexLsVersion} (tag '{ltexLsTag}').")
+  downloadUrls = getDownloadUrlsOfGitHubRelease(release)
   assetFileNames = [x for x in downloadUrls if x != f"ltex-ls-{ltexLsVersion}.tar.gz"]
   assetFileNames.sort()
-  hashDigests = []
-
-  for assetFileName in assetFileNames:
-    print(f"Downloading '{assetFileName}'...")
-    ltexLsUrl = ("https://github.com/valentjn/ltex-ls/releases/download/"
-        f"{urllib.parse.quote_plus(ltexLsTag)}/{assetFileName}")
-    response = common.requestFromGitHub(ltexLsUrl, decodeAsJson=False)
-
-    print("Computing hash digest...")
-    hashDigest = hashlib.sha256(response).hexdigest()
-    print(f"Hash digest is '{hashDigest}'.")
-    hashDigests.append(hashDigest)
+  ltexLsUrls = [("https://github.com/valentjn/ltex-ls/releases/download/"
+      f"{urllib.parse.quote_plus(ltexLsTag)}/{x}") for x in assetFileNames]
+
+  print("Downloading {} and computing hash digests...".format(
+      ", ".join(f"'{x}'" for x in assetFileNames)))
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    hashDigests = list(executor.map(computeHashDigestOfDownload, ltexLsUrls))
+
+  for assetFileName, hashDigest in zip(assetFileNames, hashDigests):
+    print(f"Hash digest of '{assetFileName}' is '{hashDigest}'.")
 
   hashDigestsTypescript = "".join(f"    '{x}':\n      '{y}',\n"
       for x, y in zip(assetFileNames, hashDigests))
@@ -1,13 +1,24 @@
 #!/usr/bin/python3
 
+import argparse
 import ast
 import base64
+import concurrent.futures
+import contextlib
+import ctypes
+import hashlib
 import json
 import os
 import pathlib
 import re
+import select
 import sys
-from typing import Any, List
+import threading
+import time
+import traceback
+from typing import (Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple,
+    cast)
+import urllib.error
 
 import jsonschema
 
@@ -18,15 +29,77 @@ import common
 
 packageJsonFilePath = common.repoDirPath.joinpath("package.json")
 with open(packageJsonFilePath, "r") as f: packageJson = json.load(f)
+vsCodeJsonSchemaCacheFilePath = common.cacheDirPath.joinpath("vsCodeJsonSchemas.json")
+vsCodeJsonSchemaCacheLock = threading.Lock()
+jsonSchemaValidators: Dict[str, Tuple[Any, Any]] = {}
+typeScriptNlsKeyCacheFilePath = common.cacheDirPath.joinpath("typeScriptNlsKeys.json")
+typeScriptNlsKeyRegex = re.compile(r"i18n\('(.*?)'")
 
 
 
-def getJsonSchemaFromVsCodeGitHub(typeScriptPath: str, regex: re.Pattern[str]) -> Any:
-  response = common.requestFromGitHub(
-      f"https://api.github.com/repos/microsoft/vscode/contents/{typeScriptPath}")
-  assert(response["encoding"] == "base64")
-  configurationExtensionPointJavaScript = base64.b64decode(response["content"]).decode()
+class ValidationResult(NamedTuple):
+  name: str
+  duration: float
+  error: Optional[str]
 
+
+
+def getJsonSchemaFromVsCodeGitHub(typeScriptPath: str, regex: re.Pattern[str],
+      offline: bool = False) -> Tuple[Any, str]:
+  # extracted schemas are cached by blob SHA of the TypeScript file, which is revalidated with its
+  # ETag; offline, the last-known schema is used; the blob SHA is returned as well
+  cache = loadVsCodeJsonSchemaCache()
+  entry: Dict[str, Any] = cache.get(typeScriptPath, {"sha" : None, "etag" : "", "schemas" : {}})
+  isCached = regex.pattern in entry["schemas"]
+
+  if offline:
+    assert isCached, f"No cached schema for '{typeScriptPath}', run once without --offline"
+    return entry["schemas"][regex.pattern], entry["sha"]
+
+  headers = common.getGitHubHeaders()
+  if isCached: headers["If-None-Match"] = entry["etag"]
+
+  try:
+    response = common.gitHubSession.request(
+        f"https://api.github.com/repos/microsoft/vscode/contents/{typeScriptPath}",
+        headers=headers)
+  except urllib.error.HTTPError as e:
+    common.handleGitHubHttpError(e)
+
+  if response.status == 304:
+    return entry["schemas"][regex.pattern], entry["sha"]
+
+  contents = json.loads(response.body)
+
+  if entry["sha"] != contents["sha"]:
+    entry = {"sha" : contents["sha"], "schemas" : {}}
+
+  entry["etag"] = response.headers.get("ETag", "")
+
+  if regex.pattern not in entry["schemas"]:
+    assert(contents["encoding"] == "base64")
+    entry["schemas"][regex.pattern] = convertTypeScriptToJsonSchema(
+        base64.b64decode(contents["content"]).decode(), regex)
+
+  with vsCodeJsonSchemaCacheLock:
+    # reload, as other checks might have updated the cache in the meantime
+    cache = loadVsCodeJsonSchemaCache()
+    cache[typeScriptPath] = entry
+    common.writeFileAtomically(vsCodeJsonSchemaCacheFilePath, json.dumps(cache).encode())
+
+  return entry["schemas"][regex.pattern], entry["sha"]
+
+
+def loadVsCodeJsonSchemaCache() -> Dict[str, Any]:
+  try:
+    with open(vsCodeJsonSchemaCacheFilePath, "r") as f: return cast(Dict[str, Any], json.load(f))
+  except (OSError, ValueError):
+    return {}
+
+
+
+def convertTypeScriptToJsonSchema(configurationExtensionPointJavaScript: str,
+      regex: re.Pattern[str]) -> Any:
   regexMatch = regex.search(configurationExtensionPointJavaScript)
   assert regexMatch is not None
   string = regexMatch.group(1)
@@ -50,33 +123,68 @@ def getJsonSchemaFromVsCodeGitHub(typeScriptPath: str, regex: re.Pattern[str]) -
 
 
 
+def getJsonFingerprint(value: Any) -> str:
+  return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+
+def getJsonSchemaValidator(jsonSchema: Any, schemaKey: str, schemaVersion: Any = None) -> Any:
+  # validators (including the check of the schema against its meta-schema) are compiled once per
+  # version of a schema; schemaKey names the schema (only its last version is kept), and
+  # schemaVersion identifies the version cheaply (e.g., mtime of its file), otherwise the schema
+  # itself is compared, which is only meant for small schemas
+  if schemaVersion is None: schemaVersion = jsonSchema
+  entry = jsonSchemaValidators.get(schemaKey)
+
+  if (entry is None) or ((entry[0] is not schemaVersion) and (entry[0] != schemaVersion)):
+    validatorClass = jsonschema.validators.validator_for(jsonSchema)
+    validatorClass.check_schema(jsonSchema)
+    entry = (schemaVersion, validatorClass(jsonSchema))
+    jsonSchemaValidators[schemaKey] = entry
+
+  return entry[1]
+
+
+
+def validateJson(instance: Any, jsonSchema: Any, schemaKey: str,
+      schemaVersion: Any = None) -> None:
+  # same as jsonschema.validate(), but with memoized validators
+  error = jsonschema.exceptions.best_match(
+      getJsonSchemaValidator(jsonSchema, schemaKey, schemaVersion).iter_errors(instance))
+  if error is not None: raise error
+
+
+
 def validatePackageJsonWithSchema() -> None:
   print("Validating package.json with schema from JSON Schema Store...")
 
   packageJsonSchemaFilePath = common.repoDirPath.joinpath("schemas", "package.schema.json")
+  fileStat = packageJsonSchemaFilePath.stat()
   with open(packageJsonSchemaFilePath, "r") as f: packageJsonSchema = json.load(f)
-  jsonschema.validate(packageJson, packageJsonSchema)
+  validateJson(packageJson, packageJsonSchema, "packageJson",
+      (fileStat.st_mtime_ns, fileStat.st_size))
 
 
 
-def validatePackageJsonWalkthroughsWithSchema() -> None:
+def validatePackageJsonWalkthroughsWithSchema(offline: bool = False) -> None:
   print("Validating package.json walkthroughs with schema from VS Code...")
 
-  jsonSchema = getJsonSchemaFromVsCodeGitHub(
+  jsonSchema, jsonSchemaSha = getJsonSchemaFromVsCodeGitHub(
       "src/vs/workbench/contrib/welcome/gettingStarted/browser/gettingStartedExtensionPoint.ts",
       re.compile(r"const walkthroughsExtensionPoint.* = (?s:.*?^\tjsonSchema: (\{.*?^\t\}))",
-        flags=re.MULTILINE))
-  jsonschema.validate(packageJson["contributes"]["walkthroughs"], jsonSchema)
+        flags=re.MULTILINE), offline)
+  validateJson(packageJson["contributes"]["walkthroughs"], jsonSchema, "walkthroughs",
+      jsonSchemaSha)
 
 
 
-def validatePackageJsonConfigurationWithSchema() -> None:
+def validatePackageJsonConfigurationWithSchema(offline: bool = False) -> None:
   print("Validating package.json configuration with schema from VS Code...")
 
-  configurationEntrySchema = getJsonSchemaFromVsCodeGitHub(
+  configurationEntrySchema, configurationEntrySchemaSha = getJsonSchemaFromVsCodeGitHub(
       "src/vs/workbench/api/common/configurationExtensionPoint.ts",
       re.compile(r"const configurationEntrySchema.* = (?s:(\{.*?^\}))",
-        flags=re.MULTILINE))
+        flags=re.MULTILINE), offline)
   configurationSchema = {
 		"description" : "Contributes configuration settings.",
 		"oneOf" : [
@@ -88,25 +196,29 @@ def validatePackageJsonConfigurationWithSchema() -> None:
 		],
   }
 
-  jsonschema.validate(packageJson["contributes"]["configuration"], configurationSchema)
+  validateJson(packageJson["contributes"]["configuration"], configurationSchema, "configuration",
+      configurationEntrySchemaSha)
 
 
 
-def validatePackageJsonConfigurationWithCustomConstraints() -> None:
+def validatePackageJsonConfigurationWithCustomConstraints(
+      settingNames: Optional[Sequence[str]] = None) -> None:
   print("Validating package.json configuration with custom constraints...")
+  settings = packageJson["contributes"]["configuration"]["properties"]
+
+  for settingName in (settingNames if settingNames is not None else list(settings)):
+    setting = settings[settingName]
 
-  for settingName, setting in packageJson["contributes"]["configuration"]["properties"].items():
     try:
-      jsonschema.validate(setting["default"], setting)
-      for example in setting.get("examples", []): jsonschema.validate(example, setting)
+      validateJson(setting["default"], setting, f"setting:{settingName}")
+      for example in setting.get("examples", []):
+        validateJson(example, setting, f"setting:{settingName}")
 
       assert ("markdownDescription" in setting) or (
           ("markdownDeprecationMessage" in setting) and ("deprecationMessage" in setting))
       validateSetting(setting)
-    except:
-      print("")
-      print(f"Could not validate '{settingName}'!")
-      raise
+    except Exception as e:
+      raise AssertionError(f"Could not validate '{settingName}'") from e
 
 
 
@@ -130,53 +242,46 @@ def validateSetting(setting: Any) -> None:
 
 
 
-def validatePackageNlsJson() -> None:
-  usedNlsKeys = getUsedNlsKeysFromPackageNlsJson(packageJson)
+def getPackageNlsJsonFilePaths() -> List[pathlib.Path]:
+  return [x for x in common.repoDirPath.iterdir()
+      if x.is_file() and (re.match(r"^package\.nls(\..+)?\.json$", x.name) is not None)]
 
-  for childPath in common.repoDirPath.iterdir():
-    if not childPath.is_file(): continue
-    regexMatch = re.match(r"^package\.nls(\..+)?\.json$", childPath.name)
-    if regexMatch is None: continue
 
-    print(f"Validating {childPath.name}...")
-    with open(childPath, "r") as f: packageNlsJson = json.load(f)
 
-    for nlsKey in sorted(list(packageNlsJson)):
-      if nlsKey.endswith(".fullMarkdownDescription"): continue
-      assert nlsKey in usedNlsKeys, f"NLS key '{nlsKey}' is defined, but unused"
+def getMessagesNlsJsonFilePaths() -> List[pathlib.Path]:
+  return [x for x in common.repoDirPath.joinpath("i18n").iterdir()
+      if x.is_file() and (re.match(r"^messages\.nls(\..+)?\.json$", x.name) is not None)]
 
-    for nlsKey in usedNlsKeys:
-      assert nlsKey in packageNlsJson, f"NLS key '{nlsKey}' is used, but undefined"
 
 
+def validatePackageNlsJson(filePaths: Optional[Sequence[pathlib.Path]] = None) -> None:
+  usedNlsKeys = common.getUsedNlsKeysFromPackageJson(packageJson)
 
-def getUsedNlsKeysFromPackageNlsJson(setting: Any) -> List[str]:
-  usedNlsKeys = []
+  for childPath in (filePaths if filePaths is not None else getPackageNlsJsonFilePaths()):
+    print(f"Validating {childPath.name}...")
+    with open(childPath, "r") as f: nlsKeys = set(json.load(f))
 
-  if isinstance(setting, list):
-    for entry in setting: usedNlsKeys.extend(getUsedNlsKeysFromPackageNlsJson(entry))
-  elif isinstance(setting, dict):
-    for value in setting.values(): usedNlsKeys.extend(getUsedNlsKeysFromPackageNlsJson(value))
-  elif isinstance(setting, str):
-    if setting.startswith("%") and setting.endswith("%"): usedNlsKeys.append(setting[1 : -1])
+    unusedNlsKeys = [x for x in sorted(nlsKeys - usedNlsKeys)
+        if not x.endswith(".fullMarkdownDescription")]
+    assert len(unusedNlsKeys) == 0, "NLS keys {} are defined, but unused".format(
+        ", ".join(f"'{x}'" for x in unusedNlsKeys))
 
-  return sorted(list(set(usedNlsKeys)))
+    undefinedNlsKeys = sorted(usedNlsKeys - nlsKeys)
+    assert len(undefinedNlsKeys) == 0, "NLS keys {} are used, but undefined".format(
+        ", ".join(f"'{x}'" for x in undefinedNlsKeys))
 
 
 
-def validateMessagesNlsJson() -> None:
+def validateMessagesNlsJson(filePaths: Optional[Sequence[pathlib.Path]] = None) -> None:
   usedNlsKeys = getUsedNlsKeysFromTypeScript()
 
-  for childPath in common.repoDirPath.joinpath("i18n").iterdir():
-    if not childPath.is_file(): continue
-    regexMatch = re.match(r"^messages\.nls(\..+)?\.json$", childPath.name)
-    if regexMatch is None: continue
-
+  for childPath in (filePaths if filePaths is not None else getMessagesNlsJsonFilePaths()):
     print(f"Validating {childPath.name}...")
     with open(childPath, "r") as f: messagesNlsJson = json.load(f)
 
-    for nlsKey in sorted(list(messagesNlsJson)):
-      assert nlsKey in usedNlsKeys, f"NLS key '{nlsKey}' is defined, but unused"
+    unusedNlsKeys = sorted(set(messagesNlsJson) - usedNlsKeys)
+    assert len(unusedNlsKeys) == 0, "NLS keys {} are defined, but unused".format(
+        ", ".join(f"'{x}'" for x in unusedNlsKeys))
 
     previousNlsKey = None
 
@@ -188,35 +293,283 @@ def validateMessagesNlsJson() -> None:
             f"NLS key '{previousNlsKey}' should come after NLS key '{nlsKey}', but comes before"
 
     if childPath.name == "messages.nls.json":
-      for nlsKey in usedNlsKeys:
-        assert nlsKey in messagesNlsJson, f"NLS key '{nlsKey}' is used, but undefined"
+      undefinedNlsKeys = sorted(usedNlsKeys - set(messagesNlsJson))
+      assert len(undefinedNlsKeys) == 0, "NLS keys {} are used, but undefined".format(
+          ", ".join(f"'{x}'" for x in undefinedNlsKeys))
 
 
 
-def getUsedNlsKeysFromTypeScript() -> List[str]:
-  usedNlsKeys = []
+def getUsedNlsKeysFromTypeScript() -> Set[str]:
+  # keys are cached per file by mtime and size, so that only changed files are scanned again
+  srcDirPath = common.repoDirPath.joinpath("src")
 
-  for rootPathString, dirNames, fileNames in os.walk(common.repoDirPath.joinpath("src")):
-    rootPath = pathlib.Path(rootPathString)
-    dirNames.sort()
-    fileNames.sort()
+  try:
+    with open(typeScriptNlsKeyCacheFilePath, "r") as f: cache = json.load(f)
+  except (OSError, ValueError):
+    cache = {}
 
+  newCache: Dict[str, List[Any]] = {}
+
+  for rootPathString, _, fileNames in os.walk(srcDirPath):
     for fileName in fileNames:
-      filePath = rootPath.joinpath(fileName)
-      with open(filePath, "r") as f: typeScript = f.read()
-      usedNlsKeys.extend(re.findall("i18n\('(.*?)'", typeScript))
+      filePath = pathlib.Path(rootPathString, fileName)
+      fileStat = filePath.stat()
+      relativeFilePath = filePath.relative_to(srcDirPath).as_posix()
+      entry = cache.get(relativeFilePath)
+
+      if ((entry is not None) and (entry[0] == fileStat.st_mtime_ns)
+            and (entry[1] == fileStat.st_size)):
+        newCache[relativeFilePath] = entry
+      else:
+        newCache[relativeFilePath] = [fileStat.st_mtime_ns, fileStat.st_size,
+            scanTypeScriptFileForNlsKeys(filePath)]
+
+  if newCache != cache:
+    common.writeFileAtomically(typeScriptNlsKeyCacheFilePath,
+        json.dumps(newCache, separators=(",", ":")).encode())
+
+  return {x for entry in newCache.values() for x in entry[2]}
+
+
+
+def scanTypeScriptFileForNlsKeys(filePath: pathlib.Path) -> List[str]:
+  with open(filePath, "r") as f: return sorted(set(typeScriptNlsKeyRegex.findall(f.read())))
+
+
+
+def runValidationCheck(name: str, check: Callable[[], None]) -> ValidationResult:
+  startTime = time.perf_counter()
+
+  try:
+    check()
+    error = None
+  except (Exception, SystemExit):
+    error = traceback.format_exc()
 
-  return sorted(list(set(usedNlsKeys)))
+  return ValidationResult(name, time.perf_counter() - startTime, error)
+
+
+
+def runValidationChecks(checks: Sequence[Tuple[str, Callable[[], None]]],
+      numberOfJobs: int) -> List[ValidationResult]:
+  # the checks are independent and share the parsed package.json, so a failing check does not
+  # prevent the others from running
+  with concurrent.futures.ThreadPoolExecutor(numberOfJobs) as executor:
+    return list(executor.map(lambda x: runValidationCheck(*x), checks))
+
+
+
+def printValidationReport(results: Sequence[ValidationResult]) -> None:
+  print("")
+
+  for result in results:
+    print(f"{result.name}: {'OK' if result.error is None else 'FAILED'} "
+        f"({result.duration:.2f} s)")
+
+  for result in results:
+    if result.error is None: continue
+    print("")
+    print(f"Check '{result.name}' failed:")
+    print(result.error, end="")
+
+
+
+class FileWatcher:
+  # wakes up on changes in the watched directories with inotify on Linux, otherwise it polls
+  IN_MODIFY = 0x2
+  IN_ATTRIB = 0x4
+  IN_CLOSE_WRITE = 0x8
+  IN_MOVED_FROM = 0x40
+  IN_MOVED_TO = 0x80
+  IN_CREATE = 0x100
+  IN_DELETE = 0x200
+  inotifyMask = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+      | IN_DELETE)
+
+  def __init__(self, pollInterval: float = 0.1) -> None:
+    self.pollInterval = pollInterval
+    self.libc: Optional[ctypes.CDLL] = None
+    self.inotifyFileDescriptor = -1
+
+    if sys.platform.startswith("linux"):
+      try:
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.inotifyFileDescriptor = self.libc.inotify_init1(os.O_CLOEXEC)
+      except (OSError, AttributeError):
+        self.libc = None
+
+  def watch(self, dirPaths: Iterable[pathlib.Path]) -> None:
+    if (self.libc is None) or (self.inotifyFileDescriptor < 0): return
+
+    # adding an already watched directory again is a no-op
+    for dirPath in dirPaths:
+      self.libc.inotify_add_watch(self.inotifyFileDescriptor, os.fsencode(dirPath),
+          self.inotifyMask)
+
+  def wait(self) -> None:
+    if (self.libc is None) or (self.inotifyFileDescriptor < 0):
+      time.sleep(self.pollInterval)
+      return
+
+    select.select([self.inotifyFileDescriptor], [], [])
+
+    # editors often save in several steps, so wait for the events to settle
+    while len(select.select([self.inotifyFileDescriptor], [], [], 0.02)[0]) > 0:
+      os.read(self.inotifyFileDescriptor, 1 << 16)
+
+
+
+def getWatchedDirPaths() -> List[pathlib.Path]:
+  srcDirPath = common.repoDirPath.joinpath("src")
+  return ([common.repoDirPath, common.repoDirPath.joinpath("i18n"), srcDirPath]
+      + [x for x in srcDirPath.rglob("*") if x.is_dir()])
+
+
+
+def getWatchedFileStats() -> Dict[pathlib.Path, Tuple[int, int]]:
+  filePaths = ([packageJsonFilePath] + getPackageNlsJsonFilePaths()
+      + getMessagesNlsJsonFilePaths()
+      + [x for x in common.repoDirPath.joinpath("src").rglob("*") if x.is_file()])
+  fileStats = {}
+
+  for filePath in filePaths:
+    try:
+      fileStat = filePath.stat()
+    except OSError:
+      continue
+
+    fileStats[filePath] = (fileStat.st_mtime_ns, fileStat.st_size)
+
+  return fileStats
+
+
+
+def getPackageJsonFingerprints(packageJson: Any) -> Dict[str, Any]:
+  contributes = packageJson["contributes"]
+  return {
+        "walkthroughs" : getJsonFingerprint(contributes.get("walkthroughs")),
+        "configuration" : getJsonFingerprint(contributes["configuration"]),
+        "settings" : {x : getJsonFingerprint(y)
+          for x, y in contributes["configuration"]["properties"].items()},
+      }
+
+
+
+def watch(numberOfJobs: int, offline: bool) -> None:
+  # keep package.json, compiled validators, and schemas in memory and only revalidate what changed
+  global packageJson
+  watcher = FileWatcher()
+  fileStats = getWatchedFileStats()
+  fingerprints = getPackageJsonFingerprints(packageJson)
+  usedNlsKeys = common.getUsedNlsKeysFromPackageJson(packageJson)
+  printValidationReport(runValidationChecks(getValidationChecks(offline), numberOfJobs))
+
+  while True:
+    watcher.watch(getWatchedDirPaths())
+    print("")
+    print("Watching for changes...")
+    changedFilePaths: Set[pathlib.Path] = set()
+
+    while len(changedFilePaths) == 0:
+      watcher.wait()
+      newFileStats = getWatchedFileStats()
+      changedFilePaths = {x for x in set(fileStats) | set(newFileStats)
+          if fileStats.get(x) != newFileStats.get(x)}
+      fileStats = newFileStats
+
+    checks: List[Tuple[str, Callable[[], None]]] = []
+    packageNlsJsonFilePaths = [x for x in getPackageNlsJsonFilePaths() if x in changedFilePaths]
+    messagesNlsJsonFilePaths = [x for x in getMessagesNlsJsonFilePaths()
+        if x in changedFilePaths]
+
+    if packageJsonFilePath in changedFilePaths:
+      try:
+        with open(packageJsonFilePath, "r") as f: newPackageJson = json.load(f)
+      except ValueError as e:
+        # the other checks still run, using the last package.json that could be parsed
+        print(f"Could not parse package.json: {e}")
+      else:
+        packageJson = newPackageJson
+        newFingerprints = getPackageJsonFingerprints(packageJson)
+        changedSettingNames = [x for x, y in newFingerprints["settings"].items()
+            if fingerprints["settings"].get(x) != y]
+        checks.append(("packageJsonSchema", validatePackageJsonWithSchema))
+
+        # schemas from VS Code have been cached by the first run
+        if newFingerprints["walkthroughs"] != fingerprints["walkthroughs"]:
+          checks.append(("walkthroughsSchema",
+              lambda: validatePackageJsonWalkthroughsWithSchema(True)))
+
+        if newFingerprints["configuration"] != fingerprints["configuration"]:
+          checks.append(("configurationSchema",
+              lambda: validatePackageJsonConfigurationWithSchema(True)))
+
+        if len(changedSettingNames) > 0:
+          checks.append(("configurationCustomConstraints",
+              lambda: validatePackageJsonConfigurationWithCustomConstraints(changedSettingNames)))
+
+        newUsedNlsKeys = common.getUsedNlsKeysFromPackageJson(packageJson)
+        if newUsedNlsKeys != usedNlsKeys: packageNlsJsonFilePaths = getPackageNlsJsonFilePaths()
+        fingerprints, usedNlsKeys = newFingerprints, newUsedNlsKeys
+
+    if any(common.repoDirPath.joinpath("src") in x.parents for x in changedFilePaths):
+      messagesNlsJsonFilePaths = getMessagesNlsJsonFilePaths()
+
+    if len(packageNlsJsonFilePaths) > 0:
+      checks.append(("packageNlsJson", lambda: validatePackageNlsJson(packageNlsJsonFilePaths)))
+
+    if len(messagesNlsJsonFilePaths) > 0:
+      checks.append(("messagesNlsJson",
+          lambda: validateMessagesNlsJson(messagesNlsJsonFilePaths)))
+
+    if len(checks) > 0: printValidationReport(runValidationChecks(checks, numberOfJobs))
+
+
+
+def getValidationChecks(offline: bool) -> List[Tuple[str, Callable[[], None]]]:
+  return [
+        ("packageJsonSchema", validatePackageJsonWithSchema),
+        ("walkthroughsSchema", lambda: validatePackageJsonWalkthroughsWithSchema(offline)),
+        ("configurationSchema", lambda: validatePackageJsonConfigurationWithSchema(offline)),
+        ("configurationCustomConstraints", validatePackageJsonConfigurationWithCustomConstraints),
+        ("packageNlsJson", validatePackageNlsJson),
+        ("messagesNlsJson", validateMessagesNlsJson),
+      ]
 
 
 
 def main() -> None:
-  validatePackageJsonWithSchema()
-  validatePackageJsonWalkthroughsWithSchema()
-  validatePackageJsonConfigurationWithSchema()
-  validatePackageJsonConfigurationWithCustomConstraints()
-  validatePackageNlsJson()
-  validateMessagesNlsJson()
+  parser = argparse.ArgumentParser(description="Validate package.json and NLS files.")
+  parser.add_argument("--offline", action="store_true",
+      help="Do not access GitHub, but use the last-known schemas from VS Code in the cache")
+  parser.add_argument("--jobs", type=int, default=6, metavar="N",
+      help="Number of checks to run in parallel (default: 6)")
+  outputGroup = parser.add_mutually_exclusive_group()
+  outputGroup.add_argument("--json", action="store_true",
+      help="Print the results as JSON to standard output and progress to standard error")
+  outputGroup.add_argument("--watch", action="store_true",
+      help="Keep running and revalidate the parts of package.json and the NLS files that change")
+  args = parser.parse_args()
+
+  if args.watch:
+    try:
+      watch(args.jobs, args.offline)
+    except KeyboardInterrupt:
+      pass
+
+    return
+
+  checks = getValidationChecks(args.offline)
+
+  if args.json:
+    with contextlib.redirect_stdout(sys.stderr): results = runValidationChecks(checks, args.jobs)
+    print(json.dumps([{"check" : x.name, "passed" : x.error is None, "duration" : x.duration,
+        "error" : x.error} for x in results], indent=2))
+  else:
+    results = runValidationChecks(checks, args.jobs)
+    printValidationReport(results)
+
+  if any(x.error is not None for x in results): sys.exit(1)
 
 
 